@@ -0,0 +1,245 @@
+# runs muspyl on a pseudo terminal against the fake server and types scripted
+# keys at it. for each scenario it reports what mpd was asked for and how long
+# a key took to show up on screen, counted up to the last byte of the frame
+import argparse
+import fcntl
+import os
+import pty
+import select
+import signal
+import struct
+import sys
+import tempfile
+import termios
+import time
+
+from fakempd import Server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DOWN = '\x1b[B'
+UP = '\x1b[A'
+RIGHT = '\x1b[C'
+LEFT = '\x1b[D'
+SHIFT_DOWN = '\x1b[1;2B'
+DELETE = '\x1b[3~'
+ENTER = '\r'
+TAB = '\t'
+
+
+class Session():
+    # one muspyl process. a frame is taken to be done once output stops for quiet seconds
+    quiet = 0.05
+
+    def __init__(self, cols, rows, port, args=()):
+        self.cache = tempfile.TemporaryDirectory()
+        started = time.monotonic()
+        self.pid, self.fd = pty.fork()
+        if self.pid == 0:
+            os.chdir(ROOT)
+            os.environ['TERM'] = 'xterm-256color'
+            os.environ['XDG_CACHE_HOME'] = self.cache.name
+            os.execvp(sys.executable, [sys.executable, 'muspyl.py', '--port', str(port), *args])
+        fcntl.ioctl(self.fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, cols*8, rows*16))
+        self.written = 0 # bytes muspyl wrote to the terminal
+        self.latencies = []
+        self.lag = None
+        self.startup = self.settle(wait=30, quiet=0.5) - started
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not ready:
+            return b''
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError:
+            raise RuntimeError('muspyl exited')
+        # answer the queries blessed and pixcat send, as a terminal would
+        if b'\x1b[6n' in data:
+            os.write(self.fd, b'\x1b[1;1R')
+        if b'\x1b_G' in data and b'a=T' in data:
+            os.write(self.fd, b'\x1b_Gi=1;OK\x1b\\')
+        self.written += len(data)
+        self.seen = time.monotonic()
+        return data
+
+    def settle(self, wait=1, quiet=None):
+        # when the last output came, once it has stopped. None if nothing came within wait
+        quiet = self.quiet if quiet is None else quiet
+        deadline = time.monotonic() + wait
+        last = None
+        while True:
+            if last is None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return None
+            else:
+                timeout = quiet
+            if self.read(timeout):
+                last = time.monotonic()
+            elif last is not None:
+                return last
+
+    def press(self, key, wait=1, quiet=None):
+        self.event(lambda: os.write(self.fd, key.encode()), wait, quiet)
+
+    def event(self, action, wait=1, quiet=None):
+        # like press, for something done to the server, counted until the screen catches up
+        sent = time.monotonic()
+        action()
+        if (last := self.settle(wait, quiet)) is not None:
+            self.latencies.append(last - sent)
+
+    def type(self, text, **kwargs):
+        for char in text:
+            self.press(char, **kwargs)
+
+    def hold(self, key, count, rate=30):
+        # like a held down key: presses come at the key repeat rate whether the
+        # screen keeps up or not. lag is how long it takes to catch up afterwards
+        for i in range(count):
+            sent = time.monotonic()
+            os.write(self.fd, key.encode())
+            while self.read(sent + 1/rate - time.monotonic()):
+                pass
+        self.settle(wait=5)
+        self.lag = max(self.seen - sent, 0)
+
+    def close(self):
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        os.waitpid(self.pid, 0)
+        os.close(self.fd)
+        self.cache.cleanup()
+
+
+def startup(session, server):
+    pass
+
+
+def scroll(session, server):
+    for i in range(100):
+        session.press(DOWN)
+    session.hold(DOWN, 300)
+    session.hold(UP, 300)
+
+
+def search(session, server):
+    session.press('3')
+    session.press(RIGHT)
+    session.press(RIGHT)
+    session.type('storm', quiet=0.3) # results come after the search delay
+
+
+def enqueue(session, server):
+    search(session, server)
+    session.press(TAB)
+    session.press('*')
+    session.press(ENTER, quiet=0.3)
+
+
+def delete(session, server):
+    for i in range(50):
+        session.press(SHIFT_DOWN)
+    session.press(DELETE, quiet=0.3)
+
+
+def filter(session, server):
+    session.press('/')
+    session.type('storm')
+    session.press(ENTER, quiet=0.3)
+
+
+def mirror(session, server):
+    # the library is listed once on the first search, the rest are answered locally
+    search(session, server)
+    session.type('\b'*5 + 'orbit', quiet=0.3)
+
+
+def update(session, server):
+    # only what picking up a changed library costs, so the first listing isn't counted
+    search(session, server)
+    server.reset_stats()
+    session.written = 0
+    session.latencies = []
+    session.event(lambda: server.touch_library(500), wait=5, quiet=0.3)
+    session.type('\b'*5 + 'storm', quiet=0.3)
+
+
+def outage(session, server):
+    # mpd goes away for a second: scrolling shouldn't notice, asking for playlists
+    # says it's offline, and once it's back the next keys reconnect. the backoff
+    # is never much longer than mpd has been gone, so that's waited out first
+    server.outage()
+    gone = time.monotonic()
+    for i in range(20):
+        session.press(DOWN)
+    session.press('3', wait=5)
+    time.sleep(1)
+    server.restore()
+    time.sleep(time.monotonic() - gone)
+    session.press('1', wait=5)
+    session.press('3', wait=5)
+    session.press(RIGHT, wait=5, quiet=0.3)
+
+
+scenarios = {i.__name__: i for i in (startup, scroll, search, enqueue, delete, filter, mirror, update, outage)}
+flags = {'mirror': ('--mirror',), 'update': ('--mirror',)} # muspyl options a scenario needs
+
+
+def ms(seconds):
+    return '-' if seconds is None else f'{seconds*1000:.1f}'
+
+
+def run(name, args):
+    # a fresh server each time, so one scenario's edits don't change the next one
+    server = Server(('localhost', args.port), tracks=args.tracks, queue=args.queue, playlists=args.playlists,
+                    playlist_length=args.playlist_length, latency=args.latency).start()
+    try:
+        session = Session(args.cols, args.rows, server.port, flags.get(name, ()))
+        try:
+            if name != 'startup':
+                server.reset_stats()
+                session.written = 0
+            scenarios[name](session, server)
+            stats = server.reset_stats()
+        finally:
+            session.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    latencies = sorted([session.startup] if name == 'startup' else session.latencies)
+    if not latencies:
+        latencies = [None]
+    return [name, stats['round_trips'], stats['commands'], stats['bytes'], session.written, len(session.latencies),
+            ms(latencies[len(latencies)//2]), ms(latencies[len(latencies)*95//100]), ms(latencies[-1]), ms(session.lag)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark muspyl against a fake mpd server')
+    parser.add_argument('scenarios', nargs='*', default=list(scenarios), help=f'any of {", ".join(scenarios)}')
+    parser.add_argument('--tracks', type=int, default=10000)
+    parser.add_argument('--queue', type=int, default=1000)
+    parser.add_argument('--playlists', type=int, default=50)
+    parser.add_argument('--playlist-length', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every round trip')
+    parser.add_argument('--port', type=int, default=0, help='for the fake server, any free one by default')
+    parser.add_argument('--cols', type=int, default=120)
+    parser.add_argument('--rows', type=int, default=40)
+    args = parser.parse_args()
+
+    header = ['scenario', 'round trips', 'commands', 'mpd bytes', 'tty bytes', 'keys', 'p50 ms', 'p95 ms', 'max ms', 'lag ms']
+    rows = [header]
+    for name in args.scenarios:
+        if name not in scenarios:
+            parser.error(f'no scenario {name}')
+        rows.append([str(i) for i in run(name, args)])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print('  '.join(i.ljust(w) if k == 0 else i.rjust(w) for k, (i, w) in enumerate(zip(row, widths))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,607 @@
+# stand-in for an mpd server with a made up library, for the benchmarks. only
+# the part of the protocol muspyl uses is there. the server counts round trips,
+# commands and bytes sent so a benchmark can report what a scenario cost
+import argparse
+import random
+import re
+import select
+import socket
+import socketserver
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+
+WORDS = [
+    'beethoven', 'mozart', 'night', 'river', 'glass', 'summer', 'echo', 'violet',
+    'engine', 'harbor', 'paper', 'silver', 'storm', 'velvet', 'lantern', 'orbit',
+    'canyon', 'ember', 'willow', 'static', 'meadow', 'crystal', 'shadow', 'tide',
+]
+TAGS = ('any', 'file', 'artist', 'albumartist', 'album', 'title', 'track', 'genre', 'date', 'composer', 'performer', 'disc')
+SUBSYSTEMS = ('database', 'update', 'stored_playlist', 'playlist', 'player', 'mixer', 'output', 'options')
+ARG = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+
+
+class Ack(Exception):
+    def __init__(self, errno, message):
+        super().__init__(message)
+        self.errno = errno
+        self.message = message
+
+
+def png(seed, size=64):
+    # tiny solid-colour png so clients have real image data to decode
+    rng = random.Random(seed)
+    colour = bytes(rng.randrange(256) for _ in range(3))
+    raw = b''.join(b'\x00' + colour*size for _ in range(size))
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+def synthesize(tracks, seed=0):
+    rng = random.Random(seed)
+    songs = []
+    per_album = 12
+    for i in range(tracks):
+        album = i // per_album
+        artist = album // 4
+        title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+        songs.append({
+            'file': f'artist{artist:05}/album{album:06}/{i%per_album+1:02} {title}.flac',
+            'Last-Modified': '2024-01-01T00:00:00Z',
+            'Artist': f'{WORDS[artist%len(WORDS)].title()} {artist}',
+            'Album': f'{WORDS[album%len(WORDS)].title()} Album {album}',
+            'Title': title.title(),
+            'Track': str(i%per_album+1),
+            'Time': str(120 + i%240),
+            'duration': f'{120 + i%240}.000',
+        })
+    return songs
+
+
+class State():
+    def __init__(self, tracks=10000, queue=0, playlists=0, playlist_length=50, latency=0.0, seed=0):
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.latency = latency
+        self.library = synthesize(tracks, seed)
+        self.by_file = {song['file']: song for song in self.library}
+        self.db_update = int(time.time())
+        self.art = {}
+
+        self.queue = [] # (id, file)
+        self.queue_versions = [] # playlist version at which each position last changed
+        self.version = 1
+        self.next_id = 1
+        self.state = 'stop'
+        self.current = None # position
+        self.elapsed = 0.0
+        self.started = None
+        self.options = {'repeat': '0', 'random': '0', 'single': '0', 'consume': '0'}
+
+        self.playlists = {}
+        self.events = 0
+        self.pending = [] # list of per-connection sets of changed subsystems
+
+        rng = random.Random(seed+1)
+        files = [song['file'] for song in self.library]
+        if files:
+            self.set_queue([(None, rng.choice(files)) for _ in range(queue)])
+            for i in range(playlists):
+                self.playlists[f'playlist {i:04}'] = {
+                    'songs': [rng.choice(files) for _ in range(playlist_length)],
+                    'modified': '2024-01-01T00:00:00Z',
+                }
+
+    def notify(self, *subsystems):
+        with self.lock:
+            for pending in self.pending:
+                pending.update(subsystems)
+            self.changed.notify_all()
+
+    def set_queue(self, entries):
+        old = self.queue
+        new = []
+        for id, file in entries:
+            if id is None:
+                id = self.next_id
+                self.next_id += 1
+            new.append((id, file))
+        if new == old:
+            return
+        self.version += 1
+        versions = []
+        for pos, entry in enumerate(new):
+            if pos < len(old) and old[pos] == entry:
+                versions.append(self.queue_versions[pos])
+            else:
+                versions.append(self.version)
+        self.queue = new
+        self.queue_versions = versions
+        if self.current is not None:
+            if self.current >= len(new):
+                self.current = None
+                self.state = 'stop'
+        self.notify('playlist')
+
+    def get_elapsed(self):
+        if self.state == 'play':
+            return self.elapsed + time.monotonic() - self.started
+        return self.elapsed
+
+    def play(self, pos):
+        self.current = pos
+        self.state = 'play'
+        self.elapsed = 0.0
+        self.started = time.monotonic()
+        self.notify('player')
+
+    def modified(self, name):
+        self.playlists[name]['modified'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        self.notify('stored_playlist')
+
+
+def song_lines(song, pos=None, id=None):
+    lines = [f'{key}: {value}' for key, value in song.items()]
+    if pos is not None:
+        lines += [f'Pos: {pos}', f'Id: {id}']
+    return lines
+
+
+def parse_range(text, length):
+    if ':' in text:
+        start, end = text.split(':')
+        return int(start), int(end) if end else length
+    return int(text), int(text) + 1
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.pending = set()
+        self.server.fake.pending.append(self.pending)
+        self.stats = self.server.stats
+
+    def finish(self):
+        with self.server.fake.lock:
+            self.server.fake.pending.remove(self.pending)
+        super().finish()
+
+    def send(self, text):
+        data = text.encode('utf-8')
+        self.stats['bytes'] += len(data)
+        self.wfile.write(data)
+
+    def send_bytes(self, data):
+        self.stats['bytes'] += len(data)
+        self.wfile.write(data)
+
+    def handle(self):
+        if self.server.refusing:
+            return
+        self.server.live.add(self.request)
+        try:
+            self.serve()
+        finally:
+            self.server.live.discard(self.request)
+
+    def serve(self):
+        self.send('OK MPD 0.23.5\n')
+        batch = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode('utf-8').rstrip('\n')
+            command, args = self.parse(line)
+            if command in ('command_list_begin', 'command_list_ok_begin'):
+                batch = (command == 'command_list_ok_begin', [])
+                continue
+            if batch is not None and command != 'command_list_end':
+                batch[1].append((command, args))
+                continue
+            self.stats['round_trips'] += 1
+            if self.server.fake.latency:
+                time.sleep(self.server.fake.latency)
+            if command == 'command_list_end':
+                ok, commands = batch
+                batch = None
+                out = []
+                for i, (command, args) in enumerate(commands):
+                    self.stats['commands'] += 1
+                    self.stats['command:' + command] += 1
+                    try:
+                        out.extend(self.run(command, args))
+                    except Ack as e:
+                        self.send(''.join(f'{l}\n' for l in out))
+                        self.send(f'ACK [{e.errno}@{i}] {{{command}}} {e.message}\n')
+                        break
+                    if ok:
+                        out.append('list_OK')
+                else:
+                    self.send(''.join(f'{l}\n' for l in out) + 'OK\n')
+                continue
+            self.stats['commands'] += 1
+            self.stats['command:' + command] += 1
+            if command == 'close':
+                return
+            if command == 'idle':
+                self.idle(args)
+                continue
+            if command == 'noidle':
+                continue
+            if command in ('albumart', 'readpicture'):
+                try:
+                    self.binary(command, args)
+                except Ack as e:
+                    self.send(f'ACK [{e.errno}@0] {{{command}}} {e.message}\n')
+                continue
+            try:
+                out = self.run(command, args)
+            except Ack as e:
+                self.send(f'ACK [{e.errno}@0] {{{command}}} {e.message}\n')
+                continue
+            self.send(''.join(f'{l}\n' for l in out) + 'OK\n')
+
+    def parse(self, line):
+        parts = [a if a is not None and b == '' else b for a, b in ARG.findall(line)]
+        parts = [re.sub(r'\\(.)', r'\1', p) for p in parts]
+        return (parts[0] if parts else ''), parts[1:]
+
+    def idle(self, args):
+        fake = self.server.fake
+        wanted = set(args) or set(SUBSYSTEMS)
+        with fake.lock:
+            while not (self.pending & wanted):
+                # wake up to check for a noidle from the client
+                fake.changed.wait(0.05)
+                if select.select([self.connection], [], [], 0)[0]:
+                    break
+            changed = sorted(self.pending & wanted)
+            self.pending.difference_update(changed)
+        if not changed:
+            self.rfile.readline() # noidle
+        self.send(''.join(f'changed: {s}\n' for s in changed) + 'OK\n')
+
+    def binary(self, command, args):
+        fake = self.server.fake
+        uri, offset = args[0], int(args[1])
+        if uri not in fake.by_file:
+            raise Ack(50, 'No such file')
+        directory = uri.rsplit('/', 1)[0]
+        with fake.lock:
+            data = fake.art.get(directory)
+            if data is None:
+                data = fake.art[directory] = png(directory)
+        chunk = data[offset:offset+8192]
+        head = f'size: {len(data)}\n'
+        if command == 'readpicture':
+            head += 'type: image/png\n'
+        self.send(head + f'binary: {len(chunk)}\n')
+        self.send_bytes(chunk)
+        self.send('\nOK\n')
+
+    def run(self, command, args):
+        fake = self.server.fake
+        with fake.lock:
+            handler = getattr(self, 'cmd_' + command, None)
+            if handler is None:
+                raise Ack(5, f'unknown command "{command}"')
+            return handler(fake, *args)
+
+    def cmd_ping(self, fake):
+        return []
+
+    def cmd_status(self, fake):
+        lines = [f'{k}: {v}' for k, v in fake.options.items()]
+        lines += ['volume: 100', f'playlist: {fake.version}', f'playlistlength: {len(fake.queue)}', f'state: {fake.state}']
+        if fake.current is not None:
+            song = fake.by_file[fake.queue[fake.current][1]]
+            duration = float(song['duration'])
+            elapsed = min(fake.get_elapsed(), duration)
+            lines += [f'song: {fake.current}', f'songid: {fake.queue[fake.current][0]}',
+                      f'elapsed: {elapsed:.3f}', f'duration: {duration:.3f}', f'time: {int(elapsed)}:{int(duration)}']
+            if fake.current + 1 < len(fake.queue):
+                lines += [f'nextsong: {fake.current+1}', f'nextsongid: {fake.queue[fake.current+1][0]}']
+        return lines
+
+    def cmd_stats(self, fake):
+        return [f'songs: {len(fake.library)}', f'db_update: {fake.db_update}', 'uptime: 1', 'playtime: 0']
+
+    def cmd_currentsong(self, fake):
+        if fake.current is None:
+            return []
+        id, file = fake.queue[fake.current]
+        return song_lines(fake.by_file[file], fake.current, id)
+
+    def cmd_playlistinfo(self, fake, which=None):
+        start, end = (0, len(fake.queue)) if which is None else parse_range(which, len(fake.queue))
+        lines = []
+        for pos in range(start, min(end, len(fake.queue))):
+            id, file = fake.queue[pos]
+            lines += song_lines(fake.by_file[file], pos, id)
+        return lines
+
+    def cmd_plchanges(self, fake, version, which=None):
+        start, end = (0, len(fake.queue)) if which is None else parse_range(which, len(fake.queue))
+        lines = []
+        for pos in range(start, min(end, len(fake.queue))):
+            if fake.queue_versions[pos] > int(version):
+                id, file = fake.queue[pos]
+                lines += song_lines(fake.by_file[file], pos, id)
+        return lines
+
+    def cmd_plchangesposid(self, fake, version, which=None):
+        start, end = (0, len(fake.queue)) if which is None else parse_range(which, len(fake.queue))
+        lines = []
+        for pos in range(start, min(end, len(fake.queue))):
+            if fake.queue_versions[pos] > int(version):
+                lines += [f'cpos: {pos}', f'Id: {fake.queue[pos][0]}']
+        return lines
+
+    def cmd_playlistid(self, fake, id=None):
+        if id is None:
+            return self.cmd_playlistinfo(fake)
+        for pos, (song_id, file) in enumerate(fake.queue):
+            if str(song_id) == id:
+                return song_lines(fake.by_file[file], pos, song_id)
+        raise Ack(50, 'No such song')
+
+    def cmd_playlistsearch(self, fake, *args):
+        pairs = [(args[i], args[i+1].lower()) for i in range(0, len(args), 2)]
+        for tag, needle in pairs:
+            if tag.lower() not in TAGS:
+                raise Ack(2, f'Unknown filter type: {tag}')
+        lines = []
+        for pos, (id, file) in enumerate(fake.queue):
+            song = fake.by_file[file]
+            if all(any(needle in value.lower() for value in (song.values() if tag == 'any' else [song.get(tag.title(), '')])) for tag, needle in pairs):
+                lines += song_lines(song, pos, id)
+        return lines
+
+    def cmd_add(self, fake, uri):
+        if uri not in fake.by_file:
+            raise Ack(50, 'No such directory')
+        fake.set_queue(fake.queue + [(None, uri)])
+        return []
+
+    def cmd_addid(self, fake, uri):
+        self.cmd_add(fake, uri)
+        return [f'Id: {fake.queue[-1][0]}']
+
+    def cmd_delete(self, fake, which):
+        start, end = parse_range(which, len(fake.queue))
+        if start >= len(fake.queue) or end > len(fake.queue):
+            raise Ack(2, 'Bad song index')
+        current = fake.current
+        fake.set_queue(fake.queue[:start] + fake.queue[end:])
+        if current is not None and fake.current is not None:
+            if start <= current < end:
+                fake.current = None
+                fake.state = 'stop'
+                fake.notify('player')
+            elif current >= end:
+                fake.current = current - (end - start)
+        return []
+
+    def cmd_deleteid(self, fake, id):
+        for pos, (qid, file) in enumerate(fake.queue):
+            if qid == int(id):
+                return self.cmd_delete(fake, str(pos))
+        raise Ack(50, 'No such song')
+
+    def cmd_clear(self, fake):
+        fake.set_queue([])
+        fake.current = None
+        fake.state = 'stop'
+        return []
+
+    def cmd_playid(self, fake, id):
+        for pos, (qid, file) in enumerate(fake.queue):
+            if qid == int(id):
+                fake.play(pos)
+                return []
+        raise Ack(50, 'No such song')
+
+    def cmd_play(self, fake, pos='0'):
+        if int(pos) >= len(fake.queue):
+            raise Ack(2, 'Bad song index')
+        fake.play(int(pos))
+        return []
+
+    def cmd_pause(self, fake, value=None):
+        if fake.state == 'play':
+            fake.elapsed = fake.get_elapsed()
+            fake.state = 'pause'
+        elif fake.state == 'pause':
+            fake.started = time.monotonic()
+            fake.state = 'play'
+        fake.notify('player')
+        return []
+
+    def cmd_next(self, fake):
+        if fake.current is None:
+            return []
+        if fake.current + 1 < len(fake.queue):
+            fake.play(fake.current + 1)
+        else:
+            fake.current = None
+            fake.state = 'stop'
+            fake.notify('player')
+        return []
+
+    def cmd_repeat(self, fake, value):
+        fake.options['repeat'] = value
+        fake.notify('options')
+        return []
+
+    def cmd_random(self, fake, value):
+        fake.options['random'] = value
+        fake.notify('options')
+        return []
+
+    def cmd_listplaylists(self, fake):
+        lines = []
+        for name, playlist in fake.playlists.items():
+            lines += [f'playlist: {name}', f'Last-Modified: {playlist["modified"]}']
+        return lines
+
+    def get_playlist(self, fake, name):
+        if name not in fake.playlists:
+            raise Ack(50, 'No such playlist')
+        return fake.playlists[name]
+
+    def cmd_listplaylist(self, fake, name):
+        return [f'file: {file}' for file in self.get_playlist(fake, name)['songs']]
+
+    def cmd_listplaylistinfo(self, fake, name):
+        lines = []
+        for file in self.get_playlist(fake, name)['songs']:
+            lines += song_lines(fake.by_file[file])
+        return lines
+
+    def cmd_playlistadd(self, fake, name, uri):
+        if uri not in fake.by_file:
+            raise Ack(50, 'No such directory')
+        fake.playlists.setdefault(name, {'songs': [], 'modified': ''})['songs'].append(uri)
+        fake.modified(name)
+        return []
+
+    def cmd_playlistdelete(self, fake, name, which):
+        songs = self.get_playlist(fake, name)['songs']
+        start, end = parse_range(which, len(songs))
+        if start >= len(songs) or end > len(songs):
+            raise Ack(2, 'Bad song index')
+        del songs[start:end]
+        fake.modified(name)
+        return []
+
+    def cmd_playlistclear(self, fake, name):
+        fake.playlists.setdefault(name, {'songs': [], 'modified': ''})['songs'] = []
+        fake.modified(name)
+        return []
+
+    def cmd_save(self, fake, name):
+        if name in fake.playlists:
+            raise Ack(56, 'Playlist already exists')
+        fake.playlists[name] = {'songs': [file for _, file in fake.queue], 'modified': ''}
+        fake.modified(name)
+        return []
+
+    def cmd_rm(self, fake, name):
+        self.get_playlist(fake, name)
+        del fake.playlists[name]
+        fake.notify('stored_playlist')
+        return []
+
+    def cmd_load(self, fake, name):
+        fake.set_queue(fake.queue + [(None, file) for file in self.get_playlist(fake, name)['songs']])
+        return []
+
+    def cmd_search(self, fake, tag, needle):
+        needle = needle.lower()
+        lines = []
+        for song in fake.library:
+            values = song.values() if tag == 'any' else [song.get(tag.title(), '')]
+            if any(needle in value.lower() for value in values):
+                lines += song_lines(song)
+        return lines
+
+    def cmd_find(self, fake, *args):
+        if len(args) == 1:
+            match = re.match(r"\(modified-since '(.*)'\)", args[0])
+            since = match.group(1) if match else ''
+        else:
+            since = args[1]
+        if since.isdigit():
+            since = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(int(since)))
+        lines = []
+        for song in fake.library:
+            if song['Last-Modified'] >= since:
+                lines += song_lines(song)
+        return lines
+
+    def cmd_listall(self, fake, uri=''):
+        return [f'file: {song["file"]}' for song in fake.library if song['file'].startswith(uri)]
+
+    def cmd_listallinfo(self, fake, uri=''):
+        lines = []
+        for song in fake.library:
+            if song['file'].startswith(uri):
+                lines += song_lines(song)
+        return lines
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('localhost', 0), **kwargs):
+        super().__init__(address, Handler)
+        self.fake = State(**kwargs)
+        self.stats = Counter()
+        self.live = set()
+        self.refusing = False
+
+    def handle_error(self, request, client_address):
+        pass # dropped clients are expected
+
+    def outage(self):
+        # drop every connection and hang up on new ones until restore()
+        self.refusing = True
+        for sock in list(self.live):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def restore(self):
+        self.refusing = False
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def reset_stats(self):
+        stats = Counter(self.stats)
+        self.stats.clear()
+        return stats
+
+    # helpers for scripting server-side changes from a benchmark
+    def touch_library(self, count):
+        with self.fake.lock:
+            stamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time()+1))
+            for song in self.fake.library[:count]:
+                song['Last-Modified'] = stamp
+                song['Title'] += ' (remastered)'
+            self.fake.db_update = max(int(time.time()), self.fake.db_update + 1)
+            self.fake.notify('database', 'update')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fake MPD server with a synthetic library')
+    parser.add_argument('--port', type=int, default=6600)
+    parser.add_argument('--tracks', type=int, default=10000)
+    parser.add_argument('--queue', type=int, default=1000)
+    parser.add_argument('--playlists', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every round trip')
+    args = parser.parse_args()
+    server = Server(('localhost', args.port), tracks=args.tracks, queue=args.queue,
+                    playlists=args.playlists, latency=args.latency)
+    print(f'fake mpd listening on {args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
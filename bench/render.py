@@ -0,0 +1,126 @@
+# times how long widgets take to draw, with muspyl running headless against the
+# fake server. nothing needs a terminal, so it runs the same anywhere. every case
+# is called over and over and the time per call is reported, or profiled
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import muspyl
+from fakempd import Server
+
+DOWN = '\x1b[B'
+ENTER = '\r'
+
+
+def scroll(term):
+    # a new row comes into view every call
+    term.queue.next()
+    term.queue.display()
+
+
+def queue(term):
+    # nothing moved, every row comes from the row cache
+    term.queue.display()
+
+
+def status(term):
+    term.status.display(refresh=False)
+
+
+def fancy(term):
+    term.status.display_fancy()
+
+
+def dialogue(term):
+    term.current_widget.display()
+
+
+def repaint(term):
+    # the whole frame written out, as after a resize
+    term.queue.next()
+    term.queue.display()
+    term.screen.shown = None
+    term.screen.flush()
+
+
+def flush(term):
+    # only what scrolling changed is written out
+    term.queue.next()
+    term.queue.display()
+    term.screen.flush()
+
+
+# case -> keys that get the player ready for it, and the call that's timed
+cases = {
+    'scroll': ('', scroll),
+    'queue': ('', queue),
+    'status': ('', status),
+    'fancy': ('2', fancy),
+    'dialogue': ('/', dialogue),
+    'repaint': ('', repaint),
+    'flush': ('', flush),
+}
+
+
+def ms(seconds):
+    return f'{seconds*1000:.3f}'
+
+
+def run(term, name, args):
+    keys, call = cases[name]
+    term.press('1')
+    if keys:
+        term.press(keys)
+    term.settle(0.2)
+    if args.profile:
+        profile = cProfile.Profile()
+        profile.runcall(lambda: [call(term) for i in range(args.calls)])
+        print(f'--- {name}')
+        pstats.Stats(profile).sort_stats('tottime').print_stats(args.profile)
+    times = []
+    for i in range(args.calls):
+        started = time.perf_counter()
+        call(term)
+        times.append(time.perf_counter() - started)
+    if keys:
+        term.press('`') # back out of the dialogue or mode
+    times.sort()
+    return [name, str(args.calls), ms(sum(times)/len(times)), ms(times[len(times)//2]), ms(times[len(times)*95//100]), ms(times[-1])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='time how long muspyl takes to draw each widget')
+    parser.add_argument('cases', nargs='*', default=list(cases), help=f'any of {", ".join(cases)}')
+    parser.add_argument('--calls', type=int, default=1000, help='times each case is drawn')
+    parser.add_argument('--tracks', type=int, default=10000)
+    parser.add_argument('--queue', type=int, default=1000)
+    parser.add_argument('--cols', type=int, default=120)
+    parser.add_argument('--rows', type=int, default=40)
+    parser.add_argument('--profile', type=int, metavar='N', default=0, help='also print the N functions taking the most time')
+    args = parser.parse_args()
+    for name in args.cases:
+        if name not in cases:
+            parser.error(f'no case {name}')
+
+    server = Server(tracks=args.tracks, queue=args.queue).start()
+    try:
+        term = muspyl.headless(args.cols, args.rows, port=server.port)
+        term.press(ENTER) # play the first song, so the status line has something on it
+        term.settle(0.2)
+        header = ['case', 'calls', 'mean ms', 'p50 ms', 'p95 ms', 'max ms']
+        rows = [header] + [run(term, name, args) for name in args.cases]
+    finally:
+        server.shutdown()
+        server.server_close()
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print('  '.join(i.ljust(w) if k == 0 else i.rjust(w) for k, (i, w) in enumerate(zip(row, widths))))
+
+
+if __name__ == '__main__':
+    main()
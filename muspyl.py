@@ -1,144 +1,1259 @@
 import blessed
 import mpd
+import mpd.asyncio
 from mpd import MPDClient
-import pixcat
-from pixcat.terminal import TERM
 
+import argparse
 import array
+import asyncio
 import fcntl
 import sys
 import termios
 import os
+import random
+import re
+import select
+import signal
+import threading
+import time
 from functools import partial
+from wcwidth import wcwidth
+from collections import Counter, deque
+from contextlib import contextmanager
 import bisect
+import hashlib
+import io
+import itertools
+import json
 
-echo = partial(print, end='', flush=True)
-debug = open('debug', 'w')
-
-
-client = MPDClient()
-client.connect('localhost', 6600)
+# set up by main, or by headless to draw without a terminal
+term = None
+client = None
 
 
 def to_timestamp(seconds):
     seconds = int(seconds)
     if seconds // 3600 != 0:
-        return f'{seconds//3600:02}:' + f'{seconds//3600//60:02}:{seconds%60:02}'
+        return f'{seconds//3600:02}:' + f'{seconds%3600//60:02}:{seconds%60:02}'
     return f'{seconds//60}:{seconds%60:02}'
 
 
+def to_ranges(indices):
+    # collapse indices into sorted, half-open (start, end) runs
+    ranges = []
+    for index in sorted(set(indices)):
+        if ranges != [] and ranges[-1][1] == index:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([index, index+1])
+    return [tuple(r) for r in ranges]
+
+
+def backoff(failures, first=0.25, longest=30):
+    # seconds to wait before reconnect attempt number failures+1. jittered so
+    # connections that dropped together don't all come back at the same moment
+    delay = min(longest, first*2**max(failures-1, 0))
+    return delay/2 + random.uniform(0, delay/2)
+
+
+def tag_text(value):
+    # multi-valued tags come back from python-mpd2 as lists
+    if isinstance(value, list):
+        return '\n'.join(value)
+    return value
+
+
+class TagIndex():
+    # per-tag postings from whitespace separated tokens to the keys containing them
+    ignored = ('pos', 'id', 'last-modified', 'time', 'duration', 'format')
+
+    def __init__(self, lict):
+        self.tokens = {} # tag -> token -> keys
+        self.text = {} # tag -> key -> lowercase value, for checking matches
+        self.wild = {} # key -> every value, for checking wildcard matches
+        self.things = {} # key -> the dict it was indexed from
+        self.hits = {} # tag -> (piece, tokens containing it) from the last lookup
+        for key, thing in lict.items():
+            self.add(key, thing)
+
+    def add(self, key, thing):
+        values = []
+        for tag, value in thing.items():
+            if tag in self.ignored:
+                continue
+            value = tag_text(value).lower()
+            values.append(value)
+            self.text.setdefault(tag, {})[key] = value
+            postings = self.tokens.setdefault(tag, {})
+            for token in value.split():
+                postings.setdefault(token, set()).add(key)
+        self.wild[key] = '\n'.join(values)
+        self.things[key] = thing
+
+    def remove(self, key):
+        for tag, text in self.text.items():
+            if (value := text.pop(key, None)) is None:
+                continue
+            postings = self.tokens[tag]
+            for token in value.split():
+                if token in postings:
+                    postings[token].discard(key)
+                    if not postings[token]:
+                        del postings[token]
+        del self.wild[key]
+        del self.things[key]
+        self.hits = {}
+
+    def sync(self, lict):
+        # a key whose dict was replaced (a song retagged, a reloaded queue keeping
+        # ids) is indexed again. replaced, not edited in place, so compare identity
+        for key in self.things.keys() - lict.dict.keys():
+            self.remove(key)
+        for key, thing in lict.dict.items():
+            if self.things.get(key) is not thing:
+                if key in self.things:
+                    self.remove(key)
+                self.add(key, thing)
+                self.hits = {}
+
+    def lookup(self, tag, piece):
+        # tokens of tag containing piece. typing only ever extends the piece,
+        # so start from the tokens that matched last time when possible
+        postings = self.tokens.get(tag, {})
+        last, tokens = self.hits.get(tag, (None, None))
+        if last is None or last not in piece:
+            tokens = postings
+        tokens = [i for i in tokens if piece in i]
+        self.hits[tag] = (piece, tokens)
+        keys = set()
+        for token in tokens:
+            keys |= postings[token]
+        return keys
+
+    def search(self, tagged, wild, within=None):
+        # a piece can't straddle tokens, so only values containing whitespace need checking afterwards
+        keys = within
+        for tag, value in list(tagged.items()) + [(None, wild)]:
+            tags = list(self.tokens) if tag is None else [tag]
+            for piece in value.split():
+                found = set()
+                for i in tags:
+                    found |= self.lookup(i, piece)
+                keys = found if keys is None else keys & found
+            if value.split() != [value] and value != '':
+                if keys is None:
+                    keys = set(self.wild)
+                if tag is None:
+                    keys = {i for i in keys if value in self.wild[i]}
+                else:
+                    text = self.text.get(tag, {})
+                    keys = {i for i in keys if value in text.get(i, '')}
+        if keys is None:
+            keys = set(self.wild)
+        return keys
+
+
 class Lict():
+    # ordered keys over a dict of values. keys may repeat (a song can be in a
+    # playlist twice), counts says how often. the keys are kept in blocks of a
+    # few hundred, so an edit at a position only shifts one block, and homes
+    # says which blocks hold each key, so finding where a key is only looks
+    # through those. block starts are summed up again after an edit, when needed
+    block = 512
+
     def __init__(self, d, l=None, sorted=False):
         self.dict = d
-        self.list = l or list(self.dict)
+        keys = l or list(self.dict)
         self.sorted = sorted
         if self.sorted:
-            self.list.sort()
+            keys.sort()
+        self.counts = Counter(keys)
+        self.length = len(keys)
+        self.blocks = [keys[i:i+self.block] for i in range(0, len(keys), self.block)]
+        self.homes = {} # key -> id of the block holding it, once per copy
+        for block in self.blocks:
+            for key in block:
+                self.homes.setdefault(key, []).append(id(block))
+        self._starts = None
+        self._order = None
 
     def __getitem__(self, key):
         if isinstance(key, int):
-            return self.dict[self.list[key]]
+            return self.dict[self.key(key)]
+        elif isinstance(key, slice):
+            return [self.dict[i] for i in self.keys(key)]
         else:
             return self.dict[key]
 
-    def delete(self, key):
-        if isinstance(key, int):
-            value = self.list[key]
-            del self.list[key]
-            if value not in self.list: # no duplicates
-                del self.dict[value]
+    def __iter__(self):
+        for block in self.blocks:
+            yield from block
+
+    def keys(self, part):
+        start, stop, step = part.indices(self.length)
+        if step != 1:
+            return [self.key(i) for i in range(start, stop, step)]
+        keys = []
+        if start >= stop:
+            return keys
+        b, offset = self.locate(start)
+        while len(keys) < stop - start:
+            keys.extend(self.blocks[b][offset:offset + stop - start - len(keys)])
+            b, offset = b + 1, 0
+        return keys
+
+    @property
+    def starts(self):
+        if self._starts is None:
+            self._starts = [0, *itertools.accumulate(map(len, self.blocks))][:-1]
+        return self._starts
+
+    @property
+    def order(self):
+        # block id -> where the block is in blocks
+        if self._order is None:
+            self._order = {id(block): b for b, block in enumerate(self.blocks)}
+        return self._order
+
+    def locate(self, position):
+        # (block, offset) of a position
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError(position)
+        b = bisect.bisect_right(self.starts, position) - 1
+        return b, position - self.starts[b]
+
+    def index(self, key):
+        b = min(self.order[i] for i in self.homes[key])
+        return self.starts[b] + self.blocks[b].index(key)
+
+    def key(self, position):
+        b, offset = self.locate(position)
+        return self.blocks[b][offset]
+
+    def positions(self, key):
+        found = []
+        for b in sorted({self.order[i] for i in self.homes[key]}):
+            found.extend(self.starts[b] + i for i, k in enumerate(self.blocks[b]) if k == key)
+        return found
+
+    def count(self, key):
+        return self.counts[key]
+
+    def edited(self, structure=False):
+        self._starts = None
+        if structure:
+            self._order = None
+
+    def rehome(self, keys, old, new):
+        for key in keys:
+            homes = self.homes[key]
+            homes[homes.index(old)] = new
+
+    def take(self, start, end):
+        # remove the keys at start:end, leaving dict and counts to the caller
+        taken = []
+        while end > start:
+            b, offset = self.locate(start)
+            block = self.blocks[b]
+            part = block[offset:offset + end - start]
+            del block[offset:offset + len(part)]
+            for key in part:
+                self.homes[key].remove(id(block))
+            taken.extend(part)
+            self.length -= len(part)
+            end -= len(part)
+            self.edited()
+            self.tidy(b)
+        return taken
+
+    def put(self, position, keys):
+        # insert keys as a run at position, leaving dict and counts to the caller
+        if not keys:
+            return
+        if not self.blocks:
+            self.blocks.append([])
+            self.edited(True)
+        if position >= self.length:
+            b, offset = len(self.blocks) - 1, len(self.blocks[-1])
         else:
-            del self.list[self.list.index(key)]
-            del self.dict[key]
+            b, offset = self.locate(position)
+        block = self.blocks[b]
+        block[offset:offset] = keys
+        for key in keys:
+            self.homes.setdefault(key, []).append(id(block))
+        self.length += len(keys)
+        self.edited()
+        self.tidy(b)
+
+    def tidy(self, b):
+        # split a block that grew too long, drop or merge one that shrank
+        block = self.blocks[b]
+        if len(block) > 2*self.block:
+            pieces = [block[i:i+self.block] for i in range(self.block, len(block), self.block)]
+            del block[self.block:]
+            for piece in pieces:
+                self.rehome(piece, id(block), id(piece))
+            self.blocks[b+1:b+1] = pieces
+            self.edited(True)
+        elif not block:
+            del self.blocks[b]
+            self.edited(True)
+        elif len(block) < self.block//4 and b+1 < len(self.blocks) and len(block) + len(self.blocks[b+1]) <= self.block:
+            after = self.blocks.pop(b+1)
+            self.rehome(after, id(after), id(block))
+            block.extend(after)
+            self.edited(True)
+
+    def forget(self, keys):
+        # drop keys from the count and from the dict once they're no longer listed
+        self.counts.subtract(keys)
+        for key in set(keys):
+            if self.counts[key] <= 0:
+                del self.counts[key]
+                del self.homes[key]
+                self.dict.pop(key, None)
+
+    def delete(self, key):
+        if not isinstance(key, int):
+            key = self.index(key)
+        elif key < 0:
+            key += self.length
+        self.forget(self.take(key, key+1))
+
+    def delete_ranges(self, ranges):
+        removed = []
+        for start, end in sorted(ranges, reverse=True):
+            removed.extend(self.take(start, min(end, self.length)))
+        self.forget(removed)
+
+    def move(self, start, end, to):
+        # like mpd's move START:END TO, to is where the block starts afterwards
+        self.put(to, self.take(start, end))
 
     def update(self, other):
         if isinstance(other, Lict):
-            self.dict.update(other.dict)
-            self.list.extend(other.list)
-        elif isinstance(other, dict):
-            self.dict.update(other)
-            self.list.extend(list(other))
-        else:
+            other = {i: other.dict[i] for i in other}
+        elif not isinstance(other, dict):
             raise TypeError(f'Can\'t update with type {type(other)}')
+        added = [key for key in other if key not in self.dict]
+        self.dict.update(other)
+        if self.sorted:
+            for key in added:
+                self.insert(key, other[key])
+            return
+        self.put(self.length, added)
+        self.counts.update(added)
 
-    def insert(self, key, value):
+    def insert(self, key, value, position=None):
         if self.sorted:
-            bisect.insort(self.list, key)
-        else:
-            self.list.append(key)
+            # the first block whose last key isn't below it, and within that block by bisecting
+            b = next((b for b, block in enumerate(self.blocks) if not block[-1] < key), len(self.blocks) - 1)
+            position = self.length if b < 0 else self.starts[b] + bisect.bisect_right(self.blocks[b], key)
+        elif position is None:
+            position = self.length
+        self.put(position, [key])
+        self.counts[key] += 1
         self.dict[key] = value
 
     def export(self):
-        self.dict = {i: self.dict[i] for i in self.list}
+        self.dict = {i: self.dict[i] for i in self}
         return self.dict
 
     def __len__(self):
-        return len(self.list)
+        return self.length
 
     def items(self):
         return self.dict.items()
 
     def __contains__(self, key):
-        return key in self.dict
+        return key in self.counts
+
+
+class Window():
+    # the queue as a lict that only holds pages of it. a page is fetched with
+    # playlistinfo START:END when a row on it is first needed, the page past the
+    # edge being approached is fetched ahead on the pool, and the pages farthest
+    # from the one in use are dropped, so memory stays the same for any length
+    page = 256 # songs per page
+    keep = 8 # pages held at once
+
+    def __init__(self, length, version):
+        self.length = length
+        self.version = version # playlist version the pages are from
+        self.stamp = 0 # bumped on every change, pages fetched before one are stale
+        self.pages = {} # page number -> songs
+        self.loading = set() # pages being fetched ahead
+        self.found = {} # position -> song a filter turned up, so its rows don't fetch pages
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.length:
+            raise IndexError(position)
+        n, offset = divmod(position, self.page)
+        if n not in self.pages and position in self.found:
+            return self.found[position]
+        if n not in self.pages:
+            self.store(n, self.stamp, client.get_queue_page(n*self.page, (n+1)*self.page))
+        if offset < self.page//4:
+            self.ahead(n-1)
+        elif offset >= self.page - self.page//4:
+            self.ahead(n+1)
+        return self.pages[n][offset]
+
+    def key(self, position):
+        return self[position]['id']
+
+    def peek(self, position):
+        # the key if its page is here, None rather than going to the server
+        n, offset = divmod(position, self.page)
+        songs = self.pages.get(n)
+        return songs[offset]['id'] if songs is not None and offset < len(songs) else None
+
+    def ahead(self, n):
+        if n < 0 or n*self.page >= self.length or n in self.pages or n in self.loading:
+            return
+        self.loading.add(n)
+        stamp = self.stamp
+        async def fetch_page(connection):
+            return await connection.playlistinfo((n*self.page, (n+1)*self.page))
+        client.pool.submit(fetch_page, lambda songs: self.store(n, stamp, songs))
+
+    def store(self, n, stamp, songs):
+        self.loading.discard(n)
+        if stamp != self.stamp:
+            return # the queue changed while it was on its way
+        self.pages[n] = songs
+        while len(self.pages) > self.keep:
+            del self.pages[max(self.pages, key=lambda i: abs(i - n))]
+
+    def keep_found(self, stamp, songs):
+        if stamp == self.stamp:
+            self.found = {int(song['pos']): song for song in songs}
+
+    def loaded(self):
+        return [(n*self.page, (n+1)*self.page) for n in sorted(self.pages)]
+
+    def drop(self, position):
+        # forget everything from position on, it gets fetched again when needed
+        first = position // self.page
+        self.pages = {n: songs for n, songs in self.pages.items() if n < first}
+        self.found = {}
+        self.stamp += 1
+
+    def apply(self, version, length, changes):
+        # changes are plchangesposid entries for the loaded pages. songs that only
+        # moved around what's loaded are reused, a page with anything new is dropped
+        known = {song['id']: song for songs in self.pages.values() for song in songs}
+        for change in changes:
+            n, offset = divmod(int(change['cpos']), self.page)
+            songs = self.pages.get(n)
+            if songs is None:
+                continue
+            song = known.get(change['id'])
+            if song is None or offset > len(songs) or (offset < len(songs) and songs[offset]['id'] == change['id']):
+                del self.pages[n] # new, or the same song with new tags
+            elif offset == len(songs):
+                songs.append(song)
+            else:
+                songs[offset] = song
+        self.length = length
+        last, rest = divmod(length, self.page)
+        self.pages = {n: songs[:rest] if n == last else songs for n, songs in self.pages.items() if n*self.page < length}
+        self.version = version
+        self.found = {}
+        self.stamp += 1
+
+    def delete(self, position):
+        self.delete_ranges([(position, position+1)])
+
+    def delete_ranges(self, ranges):
+        # mirrors a delete sent to mpd, so the version stays where it was
+        self.length -= sum(end - start for start, end in ranges)
+        self.drop(min(start for start, end in ranges))
+
+    def positions(self, key):
+        # only the loaded pages are looked through, anywhere else would be a round trip per key
+        return [n*self.page + i for n, songs in sorted(self.pages.items()) for i, song in enumerate(songs) if song['id'] == key]
+
+    def count(self, key):
+        return len(self.positions(key))
+
+    def __contains__(self, key):
+        return self.count(key) > 0
+
+
+
+class Marks():
+    # selected lict positions, each remembering its key so the selection can
+    # follow songs around when the lict changes underneath it. on a queue window
+    # only rows whose page is loaded get their key, fetching every page for a
+    # select all would pull in the whole queue. the rest are positions only
+    def __init__(self):
+        self.keys = {} # position -> key
+
+    def __contains__(self, position):
+        return position in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(sorted(self.keys))
+
+    def key(self, lict, position):
+        return lict.peek(position) if isinstance(lict, Window) else lict.key(position)
+
+    def marked(self):
+        # (positions without a key, keys)
+        return [i for i, key in self.keys.items() if key is None], [key for key in self.keys.values() if key is not None]
+
+    def add(self, lict, positions):
+        for i in positions:
+            self.keys[i] = self.key(lict, i)
+
+    def invert(self, lict, positions):
+        for i in positions:
+            if i in self.keys:
+                del self.keys[i]
+            else:
+                self.keys[i] = self.key(lict, i)
+
+    def clear(self):
+        self.keys = {}
+
+    def remap(self, lict):
+        moved = [(i, key) for i, key in self.keys.items() if i >= len(lict) or (key is not None and self.key(lict, i) != key)]
+        for i, key in moved:
+            del self.keys[i]
+        for i, key in moved:
+            if key is None:
+                continue
+            if key not in lict:
+                if i < len(lict) and self.key(lict, i) is None and i not in self.keys:
+                    self.keys[i] = key # its page isn't loaded, nothing says it moved
+                continue
+            # the nearest copy of the key that isn't already selected
+            free = [j for j in lict.positions(key) if j not in self.keys]
+            if free:
+                self.keys[min(free, key=lambda j: abs(j - i))] = key
+
+
+class Library():
+    # in-memory copy of the database so searches don't have to go to the server
+    ignored = ('last-modified', 'time', 'duration', 'format')
+
+    def __init__(self):
+        self.songs = {}
+        self.text = {}
+        self.updated = None
+
+    def add(self, song):
+        self.songs[song['file']] = song
+        values = []
+        for tag, value in song.items():
+            if tag in self.ignored:
+                continue
+            if isinstance(value, list):
+                values.extend(value)
+            else:
+                values.append(value)
+        self.text[song['file']] = '\n'.join(values).lower()
+
+    def remove(self, file):
+        del self.songs[file]
+        del self.text[file]
+
+    def search(self, search):
+        search = search.lower()
+        songs = {}
+        for file, text in tuple(self.text.items()): # may be refreshed from another thread
+            if search in text and (song := self.songs.get(file)) is not None: # removed meanwhile
+                songs[file] = song
+        return Lict(songs)
+
+
+class Stats():
+    # what muspyl asked mpd for and how long it took. client methods and pool
+    # work are timed by name, and every connection counts the commands it sends,
+    # its round trips and the bytes it gets back
+    buckets = 16 # latency histogram, bucket i counts calls that took under 2**i ms
+
+    def __init__(self):
+        self.lock = threading.RLock() # a dump can interrupt the ui thread recording
+        self.started = time.monotonic()
+        self.calls = {} # name -> [count, seconds, longest, histogram]
+        self.commands = Counter()
+        self.round_trips = 0
+        self.received = 0
+        self.reconnects = Counter() # attempts by outcome
+
+    def time(self, name, seconds):
+        with self.lock:
+            call = self.calls.get(name)
+            if call is None:
+                call = self.calls[name] = [0, 0.0, 0.0, [0]*self.buckets]
+            call[0] += 1
+            call[1] += seconds
+            call[2] = max(call[2], seconds)
+            call[3][min(int(seconds*1000).bit_length(), self.buckets-1)] += 1
+
+    def sent(self, command, round_trip):
+        with self.lock:
+            if command is not None:
+                self.commands[command] += 1
+            self.round_trips += round_trip
+
+    def read(self, size):
+        with self.lock:
+            self.received += size
+
+    def reconnected(self, ok):
+        with self.lock:
+            self.reconnects['ok' if ok else 'failed'] += 1
+
+    def report(self):
+        with self.lock:
+            return {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'uptime': round(time.monotonic() - self.started, 3),
+                'round_trips': self.round_trips,
+                'received': self.received,
+                'reconnects': dict(self.reconnects),
+                'commands': dict(self.commands),
+                'calls': {name: {
+                    'count': count,
+                    'total_ms': round(seconds*1000, 3),
+                    'max_ms': round(longest*1000, 3),
+                    'histogram_ms': {str(2**i): n for i, n in enumerate(histogram) if n},
+                } for name, (count, seconds, longest, histogram) in self.calls.items()},
+            }
+
+    def dump(self, path):
+        # one json object per line, so dumps from a session can pile up in one file
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.report()) + '\n')
+
+    def lines(self):
+        report = self.report()
+        lines = [
+            f'{report["round_trips"]} round trips, {report["received"]/1024:.1f} KiB received, '
+            f'{sum(report["reconnects"].values())} reconnects in {to_timestamp(report["uptime"])}',
+            '',
+            f'{"call":24}{"count":>7}{"mean ms":>10}{"max ms":>10}  under 1ms..{2**(self.buckets-1)}ms',
+        ]
+        bars = ' ▁▂▃▄▅▆▇█'
+        for name, (count, seconds, longest, histogram) in sorted(self.calls.items(), key=lambda i: -i[1][1]):
+            peak = max(histogram)
+            spark = ''.join(bars[(n*(len(bars)-1) + peak-1)//peak] for n in histogram)
+            lines.append(f'{name[:23]:24}{count:7}{seconds*1000/count:10.2f}{longest*1000:10.2f}  {spark}')
+        lines.append('')
+        lines.append('commands: ' + ', '.join(f'{name} {n}' for name, n in self.commands.most_common()))
+        return lines
+
+
+class Metered():
+    # the read side of a connection, counting the bytes that come in
+    def __init__(self, file, meter):
+        self.file = file
+        self.meter = meter
+
+    def readline(self):
+        data = self.file.readline()
+        self.meter.read(len(data))
+        return data
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.meter.read(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class Connection(mpd.asyncio.MPDClient):
+    # a pool connection that counts what it sends and gets back. lines are
+    # counted after decoding, so that's close to the bytes but not exact
+    def __init__(self, meter):
+        super().__init__()
+        self.meter = meter
+
+    def _write_command(self, command, args=[]):
+        self.meter.sent(command, True) # no command lists here, each one is a round trip
+        super()._write_command(command, args)
+
+    async def _read_line(self):
+        line = await super()._read_line()
+        if line is None:
+            self.meter.read(3) # OK
+        else:
+            self.meter.read(len(line) + 1 if line.isascii() else len(line.encode()) + 1)
+        return line
+
+    async def _read_chunk(self, length):
+        data = await super()._read_chunk(length)
+        self.meter.read(len(data))
+        return data
+
+
+class Pool():
+    # mpd connections run by an asyncio loop on its own thread. one is parked in
+    # idle, the others run work handed over by the ui thread. commands a piece of
+    # work sends without waiting in between are pipelined. whatever comes back
+    # is queued for the ui thread, which gets woken up to collect it
+    size = 2 # command connections
+    subsystems = ('player', 'playlist', 'stored_playlist', 'database', 'options')
+
+    def __init__(self, port, wake, meter):
+        self.port = port
+        self.wake = wake
+        self.meter = meter
+        self.lock = threading.Lock()
+        self.changes = set() # idle subsystems the ui hasn't picked up yet
+        self.results = [] # (callback, result) waiting for the ui thread
+        self.tasks = {} # key -> task, so newer work can replace older
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_exception_handler(self.report)
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.start(), self.loop)
+
+    async def connect(self):
+        connection = Connection(self.meter)
+        await connection.connect('localhost', self.port)
+        return connection
+
+    async def start(self):
+        # startup doesn't wait for these, work queues up for a free connection
+        # until they're there. start is the first thing the loop runs, so free
+        # exists before any work asks for it
+        self.free = asyncio.Queue()
+        self.watcher = asyncio.ensure_future(self.watch())
+        for i in range(self.size):
+            asyncio.ensure_future(self.replace(first=True))
+
+    async def watch(self):
+        connection = await self.open()
+        # whatever changed before this connection started idling was missed,
+        # the player is the one likely to have moved on in that time
+        self.notify(('player',))
+        while True:
+            try:
+                async for changed in connection.idle(self.subsystems):
+                    self.notify(changed)
+            except (mpd.ConnectionError, OSError):
+                pass
+            # lost the server, assume everything changed once we are back
+            connection = await self.reconnect()
+            self.notify(self.subsystems)
+
+    async def open(self):
+        # the first connection, retried like a lost one if that fails
+        try:
+            return await self.connect()
+        except (mpd.ConnectionError, OSError):
+            return await self.reconnect()
+
+    async def reconnect(self):
+        failures = 0
+        while True:
+            try:
+                connection = await self.connect()
+                self.meter.reconnected(True)
+                return connection
+            except (mpd.ConnectionError, OSError):
+                self.meter.reconnected(False)
+                failures += 1
+                await asyncio.sleep(backoff(failures))
+
+    def report(self, loop, context):
+        # a connection that drops while idling says so from a callback. it's
+        # replaced when it's next taken, so only other errors are worth printing
+        if not isinstance(context.get('exception'), (mpd.ConnectionError, OSError)):
+            loop.default_exception_handler(context)
+
+    async def replace(self, first=False):
+        self.free.put_nowait(await (self.open() if first else self.reconnect()))
+
+    def notify(self, changed):
+        with self.lock:
+            self.changes.update(changed)
+        self.wake()
+
+    def submit(self, work, callback=None, key=None, delay=0):
+        # run work(connection) on a command connection and hand its result to
+        # callback on the ui thread. work submitted under a key cancels earlier
+        # work under the same key, and delay gives it a chance to be replaced
+        asyncio.run_coroutine_threadsafe(self.run(work, callback, key, delay), self.loop)
+
+    async def run(self, work, callback, key, delay):
+        task = asyncio.current_task()
+        if key is not None:
+            if key in self.tasks:
+                self.tasks[key].cancel()
+            self.tasks[key] = task
+        try:
+            await asyncio.sleep(delay)
+            connection = await self.free.get()
+            if not connection.connected:
+                connection = await self.reconnect()
+            started = time.monotonic()
+            try:
+                result = await work(connection)
+            finally:
+                self.meter.time(getattr(work, '__name__', None) or work.func.__name__, time.monotonic() - started)
+                if connection.connected:
+                    self.free.put_nowait(connection)
+                else:
+                    asyncio.ensure_future(self.replace())
+        except (asyncio.CancelledError, mpd.MPDError, OSError):
+            return # replaced by newer work, or failed and the ui keeps what it has
+        finally:
+            if key is not None and self.tasks.get(key) is task:
+                del self.tasks[key]
+        if callback is not None:
+            with self.lock:
+                self.results.append((callback, result))
+            self.wake()
+
+    def take_changes(self):
+        with self.lock:
+            changes, self.changes = self.changes, set()
+        return changes
+
+    def deliver(self):
+        # called from the ui thread after a wake
+        with self.lock:
+            results, self.results = self.results, []
+        for callback, result in results:
+            callback(result)
+
+
+class Batch():
+    # records raw mpd commands so they can be sent as a single command list
+    def __init__(self):
+        self.calls = []
+        self.results = []
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.calls.append((name, args))
+        return call
+
+
+class ArtCache():
+    # cover art by album directory, fetched over mpd's albumart/readpicture and
+    # kept as thumbnails scaled to the size they're shown at. recently shown ones
+    # stay in memory, and every thumbnail is written to disk so an album only
+    # has to come over the network and be decoded once. pillow is imported when
+    # the first cover is, it's slow to load. this runs on the pool's threads too,
+    # so it deals in pillow images only and pixcat is left to the ui thread
+    limit = 32 << 20 # bytes of thumbnails kept in memory
+    ahead = 3 # upcoming songs to fetch covers for in the background
+
+    def __init__(self, folder=None):
+        if folder is None:
+            folder = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'muspyl', 'art')
+        self.folder = folder
+        self.images = {} # (album, size) -> (pillow image or None, bytes), in lru order
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def key(self, song, size):
+        return (os.path.dirname(song['file']), size)
+
+    def path(self, key):
+        album, size = key
+        return os.path.join(self.folder, f'{hashlib.sha1(album.encode()).hexdigest()}-{size}.png')
+
+    def cached(self, song, size):
+        # (True, image) when known without going to the server, image is None for no art
+        key = self.key(song, size)
+        with self.lock:
+            if key in self.images:
+                self.images[key] = self.images.pop(key)
+                return True, self.images[key][0]
+        if os.path.exists(path := self.path(key)):
+            import PIL.Image
+            try:
+                return True, self.store(key, PIL.Image.open(path))
+            except OSError:
+                pass
+        return False, None
+
+    def fetch(self, song, size, callback):
+        # callback gets (song, image) on the ui thread
+        async def fetch_art(connection):
+            return song, await self.load(song, size, connection)
+        client.pool.submit(fetch_art, callback)
+
+    def prefetch(self, info, size):
+        # covers for the songs after the playing one, anything asked for earlier is dropped
+        start = int(info['nextsong'])
+        count = 1 if info.get('random') == '1' else self.ahead # only the next song is known when shuffling
+        async def prefetch_art(connection):
+            for song in await connection.playlistinfo((start, start+count)):
+                await self.load(song, size, connection)
+        client.pool.submit(prefetch_art, key='prefetch')
+
+    async def load(self, song, size, connection):
+        found, image = self.cached(song, size)
+        if found:
+            return image
+        data = await client.fetch_album_art(song['file'], connection)
+        return await asyncio.get_running_loop().run_in_executor(None, self.decode, self.key(song, size), data)
+
+    def decode(self, key, data):
+        if data is None:
+            return self.store(key, None)
+        import PIL.Image
+        try:
+            image = PIL.Image.open(io.BytesIO(data)).convert('RGB').resize((key[1], key[1]), PIL.Image.LANCZOS)
+        except (OSError, ValueError):
+            return self.store(key, None)
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            image.save(self.path(key), format='PNG', compress_level=1)
+        except OSError:
+            pass # still fine to show it from memory
+        return self.store(key, image)
+
+    def store(self, key, image):
+        cost = 0
+        if image is not None:
+            image.load()
+            cost = image.width*image.height*len(image.getbands())
+        with self.lock:
+            if key in self.images:
+                self.used -= self.images.pop(key)[1]
+            self.images[key] = (image, cost)
+            self.used += cost
+            while self.used > self.limit and len(self.images) > 1:
+                self.used -= self.images.pop(next(iter(self.images)))[1]
+        return image
+
+
+class Offline(mpd.ConnectionError):
+    # mpd can't be reached right now, the client retries on its own
+    pass
 
 
 class Client(MPDClient):
-    def __init__(self, port):
+    # blocking commands on the main connection are for the quick things. anything
+    # that can take a while runs on the pool and comes back through a callback
+    search_delay = 0.15 # wait for typing to stop before searching
+    retries = 3 # reconnect attempts a command waits through before giving up
+    playlist_cache_size = 64 # stored playlists kept with their songs
+
+    def __init__(self, port, mirror=False, wake=None):
         super().__init__()
         self.port = port
+        self.meter = Stats()
         self.connect('localhost', self.port)
         self.timeout = 1
         self.state = {}
+        self.pool = Pool(self.port, wake, self.meter) if wake is not None else None
+        self.mirror = mirror
+        self.library = None
+        self.library_lock = None # made on the pool's loop
+        self.wanted = None # (search, callback) waiting for the library to load
+        self.queue = None
+        self.playlists = {} # name -> [last-modified, lict], in lru order
+        self.modified = {} # last-modified of each playlist as last listed
+        self.listed = None # stored_playlist version the listing is from
+        self.versions = Counter() # idle events seen per subsystem
+        self.down = False
+        self.failures = 0 # reconnect attempts that failed in a row
+        self.retry_at = None
+        self.pending = {} # commands to replay once mpd is back, by name
 
     def handle_timeout(func):
-        def timeout_wrapper(*args, **kwargs):
+        # a dropped connection is re-established with backoff and the command is
+        # sent again. commands marked replay=False may have run before the drop,
+        # so they're never repeated. while mpd stays unreachable commands fail
+        # straight away with Offline, and ones marked replay=True are kept for
+        # when it's back
+        replay = getattr(func, 'replay', None)
+        def attempt(self, *args, **kwargs):
+            if self.down and not (time.monotonic() >= self.retry_at and self.reconnect()):
+                return self.postpone(func, args, kwargs)
+            attempts = 0
+            while True:
+                try:
+                    return func(self, *args, **kwargs)
+                except (mpd.ConnectionError, OSError):
+                    if replay is False:
+                        self.reconnect()
+                        raise Offline(f'connection lost during {func.__name__}, not repeating it')
+                    attempts += 1 # the command and every failed reconnect count towards retries
+                    while not self.reconnect():
+                        if attempts >= self.retries:
+                            return self.postpone(func, args, kwargs)
+                        attempts += 1
+                        time.sleep(max(0, self.retry_at - time.monotonic()))
+                    if attempts >= self.retries:
+                        # mpd is there but keeps dropping this one, e.g. a reply too big for its buffer
+                        raise Offline(f'{func.__name__} kept losing the connection, gave up on it')
+        def timeout_wrapper(self, *args, **kwargs):
+            started = time.monotonic()
             try:
-                return func(*args, **kwargs)
-            except mpd.base.ConnectionError:
-                client.reconnect()
-                return timeout_wrapper(*args, **kwargs)
+                return attempt(self, *args, **kwargs)
+            finally:
+                self.meter.time(func.__name__, time.monotonic() - started)
+        timeout_wrapper.__name__ = func.__name__
         return timeout_wrapper
 
+    def replay(value):
+        def mark(func):
+            func.replay = value
+            return func
+        return mark
+
+    def connect(self, *args, **kwargs):
+        super().connect(*args, **kwargs)
+        self._rbfile = Metered(self._rbfile, self.meter)
+
+    def _write_command(self, command, args=[]):
+        # a command list goes out as one round trip when it's ended
+        if not command.startswith('command_list'):
+            self.meter.sent(command, self._command_list is None)
+        elif command == 'command_list_end':
+            self.meter.sent(None, True)
+        super()._write_command(command, args)
+
+    def supports(self, version):
+        return tuple(map(int, self.mpd_version.split('.'))) >= version
+
     def reconnect(self):
-        self.connect('localhost', self.port)
+        # one attempt, the caller decides whether to wait and try again
+        try:
+            self.disconnect()
+        except (mpd.ConnectionError, OSError):
+            pass
+        pending, self.pending = self.pending, {}
+        try:
+            self.connect('localhost', self.port)
+            self.queue = None # playlist versions restart with the server
+            for func, args, kwargs in pending.values():
+                try:
+                    func(self, *args, **kwargs)
+                except mpd.CommandError:
+                    pass
+        except (mpd.ConnectionError, OSError):
+            self.meter.reconnected(False)
+            self.pending = pending # all safe to send again next time
+            self.down = True
+            self.failures += 1
+            self.retry_at = time.monotonic() + backoff(self.failures)
+            return False
+        self.meter.reconnected(True)
+        self.down = False
+        self.failures = 0
+        return True
+
+    def postpone(self, func, args, kwargs):
+        if getattr(func, 'replay', None):
+            self.pending[func.__name__] = (func, args, kwargs)
+        raise Offline(f'mpd unreachable, retrying in {max(0, self.retry_at - time.monotonic()):.0f}s')
+
+    def fetch_changes(self):
+        changed = self.pool.take_changes()
+        self.versions.update(changed)
+        return changed
+
+    @contextmanager
+    def batch(self):
+        batch = Batch()
+        yield batch
+        batch.results = self.run_batch(batch.calls)
+
+    @handle_timeout
+    @replay(False)
+    def run_batch(self, calls):
+        # one result per call, failures are returned as their CommandError.
+        # mpd abandons a command list at the first failure, so carry on after it
+        results = []
+        while len(results) < len(calls):
+            self.command_list_ok_begin()
+            for name, args in calls[len(results):]:
+                getattr(self, name)(*args)
+            try:
+                results.extend(self.command_list_end())
+            except mpd.CommandError as e:
+                results.extend([None]*(e.offset or 0))
+                results.append(e)
+        return results
 
     @handle_timeout
     def get_all_playlists(self):
-        p = self.listplaylists()
         playlists = {}
-        for playlist in p:
-            playlist_name = playlist['playlist']
-            last_modified = playlist['last-modified']
-            playlists[playlist_name] = {'name': playlist_name}
+        modified = {}
+        for playlist in self.listplaylists():
+            name = playlist['playlist']
+            playlists[name] = {'name': name}
+            modified[name] = playlist.get('last-modified')
+        # cached songs stay good for as long as mpd reports the same last-modified.
+        # ones edited here take whatever it reports next
+        for name, entry in list(self.playlists.items()):
+            if entry[0] is None and name in modified:
+                entry[0] = modified[name]
+            elif entry[0] != modified.get(name):
+                del self.playlists[name]
+        self.modified = modified
+        self.listed = self.versions['stored_playlist']
         return Lict(playlists)
 
     @handle_timeout
     def get_playlist(self, playlist_name):
-        s = self.listplaylistinfo(playlist_name)
-        songs = {}
-        slist = []
-        for song in s:
-            songs[song['file']] = song
-            slist.append(song['file'])
-        return Lict(songs, slist)
+        if self.listed != self.versions['stored_playlist']:
+            self.get_all_playlists() # something changed, check what's cached first
+        entry = self.playlists.pop(playlist_name, None)
+        if entry is None:
+            songs = {}
+            slist = []
+            for song in self.listplaylistinfo(playlist_name):
+                songs[song['file']] = song
+                slist.append(song['file'])
+            entry = [self.modified.get(playlist_name), Lict(songs, slist)]
+        self.playlists[playlist_name] = entry # most recently used last
+        if len(self.playlists) > self.playlist_cache_size:
+            del self.playlists[next(iter(self.playlists))]
+        return entry[1]
+
+    def edited_playlist(self, playlist, batch):
+        # the cached songs of a playlist that was just edited, for the caller to
+        # change to match. a failed edit drops them, they're fetched again instead
+        entry = self.playlists.get(playlist)
+        if entry is None:
+            return None
+        if any(isinstance(result, mpd.CommandError) for result in batch.results):
+            del self.playlists[playlist]
+            return None
+        entry[0] = None
+        return entry[1]
+
+    def refresh_library(self):
+        if self.library is not None:
+            self.pool.submit(self.fetch_library_changes, key='library')
+
+    def search_songs(self, search, callback):
+        # callback gets a Lict of the results on the ui thread, unless a newer search replaced this one
+        if self.mirror and self.library is None:
+            # the library loads once on its own, so typing can't cancel it halfway.
+            # only the latest search is run when it's there
+            if self.wanted is None:
+                self.pool.submit(self.load_library, self.library_loaded)
+            self.wanted = (search, callback)
+            return
+        self.pool.submit(partial(self.fetch_songs, search), callback, key='search', delay=self.search_delay)
 
-    @handle_timeout
-    def search_songs(self, search):
-        s = self.search('any', search)
+    async def load_library(self, connection):
+        try:
+            return await self.fetch_library(connection)
+        except (mpd.MPDError, OSError):
+            return None # still has to reach library_loaded, or nothing would ask again
+
+    def library_loaded(self, library):
+        wanted, self.wanted = self.wanted, None
+        if library is not None:
+            self.search_songs(*wanted) # if it failed, the next search tries again
+
+    async def fetch_library(self, connection):
+        library = Library()
+        # stats first, so an update that lands during the listing is picked up next time.
+        # listallinfo's result has to be awaited on its own, gather never reads it
+        stats = await connection.stats()
+        songs = await connection.listallinfo()
+        for song in songs:
+            if 'file' in song:
+                library.add(song)
+        library.updated = stats.get('db_update')
+        self.library = library
+        return library
+
+    async def fetch_library_changes(self, connection):
+        self.library_lock = self.library_lock or asyncio.Lock()
+        async with self.library_lock:
+            stats = await connection.stats()
+            if stats.get('db_update') == self.library.updated:
+                return
+            for song in await connection.find('modified-since', self.library.updated):
+                self.library.add(song)
+            count = int(stats.get('songs', 0))
+            if len(self.library.songs) > count:
+                files = {song['file'] for song in await connection.listall() if 'file' in song}
+                for file in [i for i in self.library.songs if i not in files]:
+                    self.library.remove(file)
+            if len(self.library.songs) != count:
+                # files added with an old mtime slip past modified-since
+                return await self.fetch_library(connection)
+            self.library.updated = stats.get('db_update')
+
+    async def fetch_songs(self, search, connection):
+        if self.mirror:
+            return await asyncio.get_running_loop().run_in_executor(None, self.library.search, search)
         songs = {}
-        for song in s:
+        for song in await connection.search('any', search):
             songs[song['file']] = song
         return Lict(songs)
 
+    async def fetch_album_art(self, file, connection):
+        # a cover file next to the song, or failing that one embedded in it
+        for command in (connection.albumart, connection.readpicture):
+            try:
+                data = (await command(file)).get('binary')
+            except mpd.CommandError:
+                continue
+            if data:
+                return data
+        return None
+
     @handle_timeout
     def get_queue(self):
-        s = self.playlistinfo()
-        songs = {}
-        slist = []
-        for song in s:
-            songs[song['id']] = song
-            slist.append(song['id'])
-        return Lict(songs, slist)
+        # the queue is a window that fetches pages as they're shown. after a
+        # change only the pages it holds are checked, status and the changes
+        # coming from one command list so they agree on the version
+        if self.queue is None:
+            self.state = self.status()
+            self.queue = Window(int(self.state['playlistlength']), int(self.state['playlist']))
+            return self.queue
+        if self.supports((0, 21)):
+            ranges = [(r,) for r in self.queue.loaded()]
+        else:
+            ranges = [()] # no ranges before 0.21, all the changes come back
+        self.command_list_ok_begin()
+        self.status()
+        for r in ranges:
+            self.plchangesposid(self.queue.version, *r)
+        self.state, *changes = self.command_list_end()
+        version = int(self.state['playlist'])
+        if version < self.queue.version:
+            self.queue = None
+            return self.get_queue()
+        if version != self.queue.version:
+            self.queue.apply(version, int(self.state['playlistlength']), [i for c in changes for i in c])
+        return self.queue
+
+    @handle_timeout
+    def get_queue_page(self, start, end):
+        return self.playlistinfo((start, end))
+
+    def search_queue(self, tagged, wild, callback):
+        # the queue isn't all here to be indexed, so mpd filters it. callback gets
+        # the matching songs on the ui thread, unless a newer filter replaced this one
+        args = [i for tag, text in tagged.items() for i in (tag, text)]
+        if wild != '':
+            args += ['any', wild]
+        async def filter_queue(connection):
+            try:
+                return await connection.playlistsearch(*args)
+            except mpd.CommandError:
+                return [] # a tag mpd doesn't know, which matches nothing like in TagIndex
+        self.pool.submit(filter_queue, callback, key='filter', delay=self.search_delay)
 
     @handle_timeout
     def get_status(self):
@@ -149,72 +1264,133 @@ class Client(MPDClient):
     def get_playing(self):
         return self.currentsong()
 
-    @handle_timeout
-    def delete_from_playlist(self, playlist, song):
-        self.playlistdelete(playlist, song)
-
-    @handle_timeout
-    def add_to_playlist(self, playlist, song):
-        self.playlistadd(playlist, song)
+    def delete_from_playlist(self, playlist, ranges):
+        with self.batch() as batch:
+            for start, end in reversed(ranges):
+                if self.supports((0, 23, 3)):
+                    batch.playlistdelete(playlist, (start, end))
+                else:
+                    for index in reversed(range(start, end)):
+                        batch.playlistdelete(playlist, index)
+        if (lict := self.edited_playlist(playlist, batch)) is not None:
+            lict.delete_ranges(ranges)
+
+    def add_to_playlist(self, playlist, songs):
+        with self.batch() as batch:
+            for song in songs:
+                batch.playlistadd(playlist, song['file'])
+        if (lict := self.edited_playlist(playlist, batch)) is not None:
+            for song in songs:
+                lict.insert(song['file'], song)
 
     @handle_timeout
+    @replay(False)
     def delete_playlist(self, playlist):
         self.rm(playlist)
+        self.playlists.pop(playlist, None)
 
     @handle_timeout
+    @replay(False)
     def create_playlist(self, playlist):
         self.save(playlist)
         self.playlistclear(playlist)
 
     @handle_timeout
+    @replay(True)
     def clear_playlist(self, playlist):
         self.playlistclear(playlist)
+        self.playlists.pop(playlist, None)
 
     @handle_timeout
+    @replay(False) # song ids start over if mpd was restarted
     def play_from_queue(self, id):
         self.playid(id)
 
     @handle_timeout
+    @replay(False)
     def toggle_pause(self):
         self.pause()
 
     @handle_timeout
+    @replay(False)
     def skip(self):
         self.next()
 
     @handle_timeout
+    @replay(False)
     def queue_playlist(self, playlist):
         self.load(playlist)
 
     @handle_timeout
+    @replay(False)
     def queue_song(self, song):
         self.add(song)
 
     @handle_timeout
+    @replay(False)
     def dequeue(self, index):
         self.delete(index)
 
     @handle_timeout
+    @replay(True)
     def clear_queue(self):
         self.clear()
 
-    @handle_timeout
-    def get_album_art(self, song):
-        return self.albumart(song)
+    def option(self, name):
+        # what an option will be once anything postponed has gone through
+        if f'set_{name}' in self.pending:
+            return str(self.pending[f'set_{name}'][1][0])
+        return self.state.get(name)
 
-    @handle_timeout
+    # toggles pick the value when the key is pressed, so pressing one twice
+    # while offline replays as leaving it alone rather than flipping it once
     def toggle_repeat(self):
-        if self.state.get('repeat') == '0':
-            self.repeat(1)
-        else:
-            self.repeat(0)
+        self.set_repeat(1 if self.option('repeat') == '0' else 0)
 
-    @handle_timeout
     def toggle_random(self):
-        if self.state.get('random') == '0':
-            self.random(1)
-        else:
-            self.random(0)
+        self.set_random(1 if self.option('random') == '0' else 0)
+
+    @handle_timeout
+    @replay(True)
+    def set_repeat(self, value):
+        self.repeat(value)
+        self.state['repeat'] = str(value)
+
+    @handle_timeout
+    @replay(True)
+    def set_random(self, value):
+        self.random(value)
+        self.state['random'] = str(value)
+
+
+class Extent():
+    # a '%width+n;%height+n' spec parsed once: each axis is a fraction of the
+    # terminal plus a fixed number of cells
+    specs = {}
+
+    def __init__(self, spec):
+        self.axes = []
+        for axis in spec.split(';'):
+            sign = '-' if '-' in axis else '+'
+            frac, cells = axis.split(sign)
+            self.axes.append((float(frac), -int(cells) if sign == '-' else int(cells)))
+
+    @classmethod
+    def parse(cls, spec):
+        if spec not in cls.specs:
+            cls.specs[spec] = cls(spec)
+        return cls.specs[spec]
+
+    def resolve(self, width, height):
+        return tuple(int(self.scale(frac, length) + cells) for (frac, cells), length in zip(self.axes, (width, height)))
+
+    @staticmethod
+    def scale(frac, length):
+        # a whole axis is rounded down to even, most widgets here take half the
+        # screen and the halves have to line up
+        if frac == 1.0:
+            return length - length%2
+        return frac*length
 
 
 class Widget():
@@ -230,6 +1406,9 @@ class Widget():
 
         self.hide = False
 
+        self._rect = None
+        self._rect_key = None
+
     def redraw(self):
         self.display()
         return False
@@ -242,90 +1421,41 @@ class Widget():
         if self.bordered:
             self.display_shell()
         self.display()
-        self.update()
 
     def defocus(self):
         self.focused = False
         if self.bordered:
             self.display_shell()
         self.display()
-        self.update()
-
-    def interpret(self, v):
-        w, h = v.split(';')
-        if '-' in w:
-            w = w.split('-')
-            width = (float(w[0]), -int(w[1]))
-        elif '+' in w:
-            w = w.split('+')
-            width = (float(w[0]), int(w[1]))
-        if '-' in h:
-            h = h.split('-')
-            height = (float(h[0]), -int(h[1]))
-        elif '+' in h:
-            h = h.split('+')
-            height = (float(h[0]), int(h[1]))
-        return(width, height)
-        
-    def scale(self, values):
-        # format: %width+width;%height+height
-        # horribly messy but it works
-        wi, he = values.split(';')
-        if '-' in he:
-            h = he.split('-')
-        elif '+' in he:
-            h = he.split('+')
-        if '-' in wi:
-            w = wi.split('-')
-        elif '+' in wi:
-            w = wi.split('+')
-        if float(h[0]) == 1.0:
-            h0 = term.height
-            if term.height%2 == 1:
-                h0 -= 1
-            # very annoying to deal with even/odds, but most widgets here only deal with half of the screen. should fix this
-        else:
-            h0 = float(h[0])*term.height
-        if float(w[0]) == 1.0:
-            w0 = term.width
-            if term.width%2 == 1:
-                w0 -= 1
-        else:
-            w0 = float(w[0])*term.width
-        # h0 = term.height*float(h[0])
-        # w0 = term.width*float(w[0])
-        if '-' in he:
-            height = h0 - int(h[1])
-        elif '+' in he:
-            height = h0 + int(h[1])
-        if '-' in wi:
-            width = w0 - int(w[1])
-        elif '+' in wi:
-            width = w0 + int(w[1])
-        return (int(width), int(height))
 
     def scaled_dimensions(self):
-        # return (tuple(map(lambda x: x+1, self.scale(self._position))), tuple(map(lambda x: x-2, self.scale(self._size))))
-        if self.bordered:
-            return (tuple(map(lambda x: x+1, self.scale(self._position))), tuple(map(lambda x: x-2, self.scale(self._size))))
-        else:
-            return (self.scale(self._position), self.scale(self._size))
+        # worked out again only when the terminal is resized or the widget is moved
+        key = (self._position, self._size, term.sizing)
+        if self._rect_key != key:
+            height, width = term.sizing
+            position = Extent.parse(self._position).resolve(width, height)
+            size = Extent.parse(self._size).resolve(width, height)
+            if self.bordered:
+                position = (position[0]+1, position[1]+1)
+                size = (size[0]-2, size[1]-2)
+            self._rect = (position, size)
+            self._rect_key = key
+        return self._rect
 
     def display_shell(self):
         if self.hide:
             return
         position, size = self.scaled_dimensions()
-        position = (position[0] - 1, position[1] - 1)
+        x, y = position[0] - 1, position[1] - 1
         size = (size[0] + 2, size[1] + 2)
-        echo(term.normal)
+        style = term.normal
         if not self.focused:
-            echo(term.white)
-        with term.location(*position):
-            echo('┏' + '━'*(size[0]-2) + '┓' + term.move_down(1) + term.move_x(position[0]))
-            for i in range(size[1]-2):
-                echo('┃' + term.move_right(size[0]-2) + '┃' + term.move_down(1) + term.move_x(position[0]))
-            echo('┗' + '━'*(size[0]-2) + '┛')
-        echo(term.normal)
+            style = term.white
+        term.screen.write(x, y, style + '┏' + '━'*(size[0]-2) + '┓')
+        for i in range(1, size[1]-1):
+            term.screen.write(x, y+i, style + '┃')
+            term.screen.write(x+size[0]-1, y+i, style + '┃')
+        term.screen.write(x, y+size[1]-1, style + '┗' + '━'*(size[0]-2) + '┛')
 
     def add_child(self, child):
         self.children.append(child)
@@ -348,19 +1478,99 @@ class Widget():
         other.pair = self
 
 
+def text_width(text):
+    # blessed parses for sequences every time, plain tag text doesn't need it
+    if not text.isprintable():
+        return term.length(text)
+    if text.isascii():
+        return len(text)
+    return sum(max(wcwidth(i), 0) for i in text)
+
+
+def text_truncate(text, width):
+    if not text.isprintable():
+        return term.truncate(text, width)
+    total = 0
+    for i, char in enumerate(text):
+        total += max(wcwidth(char), 0)
+        if total > width:
+            return text[:i]
+    return text
+
+
+class RowFormat():
+    # a Selection's formats with styles looked up once and column widths worked
+    # out once per row width. formats[0] is for normal rows, formats[1] for the
+    # playing song, each a list of (template, style, alignment, fraction)
+    def __init__(self, formats):
+        self.formats = [[(section, getattr(term, style), alignment, frac) for section, style, alignment, frac in format] for format in formats]
+        self.layouts = {}
+
+    def columns(self, twidth, playing):
+        if (twidth, playing) not in self.layouts:
+            format = self.formats[1 if playing else 0]
+            columns = []
+            rwidth = 0 # running total of width
+            for i, (section, style, alignment, frac) in enumerate(format):
+                last = i == len(format)-1
+                if last:
+                    width = twidth - rwidth
+                else:
+                    width = int(frac*twidth)
+                    rwidth += (width + 1)
+                columns.append((section, style, alignment, width, last))
+            self.layouts[(twidth, playing)] = columns
+        return self.layouts[(twidth, playing)]
+
+    def render(self, d, twidth, hovered=False, selected=False, playing=False):
+        prefix = (term.bold if hovered else '') + (term.reverse if selected else '')
+        string = ''
+        total = 0 # printed width so far
+        for section, style, alignment, width, last in self.columns(twidth, playing):
+            string += prefix
+            text = section.format(**d)
+            length = text_width(text)
+            if length > width:
+                text = text_truncate(text, width-3) + '...'
+                length = text_width(text)
+            space = max(0, width - length)
+            if alignment == 'l':
+                string += style + text + ' '*space
+            elif alignment == 'c':
+                string += style + ' '*(space//2) + text + ' '*(space - space//2)
+            elif alignment == 'r':
+                string += style + ' '*space + text
+            if alignment in ('l', 'c', 'r'):
+                total += length + space
+            if not last:
+                string += ' '
+                total += 1
+            string += term.normal
+        return string + ' '*max(0, twidth - total)
+
+
 class Selection(Widget):
+    subsystems = () # idle subsystems whose changes make the cached lict stale
+    narrow = 4096 # most queue filter matches kept with their tags, to narrow down locally
+
     def __init__(self, lict=None, position='0.0+0;0.0+1', size='1.0+0;1.0-2', bordered=True):
         super().__init__(position, size, bordered)
 
         self.current = 0
         self.scroll = 0
 
-        self.lict = lict
-        self.update()
-        # self.filtered = self.lict.list[:]
-        # self.filter = ''
+        self._filter = ''
+        self.query = None
+        self.matched = None # keys matching the current filter. on a queue window, (stamp, TagIndex, id -> position) of the last answer or None
+        self.view = None # lict positions shown while filtering
+        self.tag_index = None
+
+        self.selected = Marks() # lict positions, not rows
 
-        self.selected = []
+        self.lict = lict
+        self.dirty = True
+        self.version = None
+        self.refresh()
 
         self.formats = [
             [('{title}', 'red', 'l', 0.5), ('{artist}', 'blue', 'r', 0.5)],
@@ -371,6 +1581,25 @@ class Selection(Widget):
     def update(self):
         pass
 
+    def invalidate(self):
+        self.dirty = True
+
+    def refresh(self):
+        # only go back to the server when something actually changed
+        version = [client.versions[i] for i in self.subsystems]
+        if self.dirty or version != self.version:
+            self.update()
+            self.dirty = False
+            self.version = version
+
+    @property
+    def formats(self):
+        return self._formats
+
+    @formats.setter
+    def formats(self, value):
+        self._formats = RowFormat(value)
+
     @property
     def lict(self):
         return self._lict
@@ -378,8 +1607,32 @@ class Selection(Widget):
     @lict.setter
     def lict(self, value):
         self._lict = value
+        self.changed()
+
+    def changed(self):
+        # the lict was replaced or edited in place, anything derived from it is stale
+        if self.tag_index is not None:
+            self.tag_index.sync(self.lict)
+        self.matched = None
+        if self.filter != '':
+            self.filter = self.filter
+        if self.selected and self.lict is not None:
+            self.selected.remap(self.lict)
         self.current = self.current
 
+    def rows(self):
+        if self.view is not None:
+            return len(self.view)
+        if self.lict is None:
+            return 0
+        return len(self.lict)
+
+    def position(self, row):
+        # lict position of a displayed row
+        if self.view is None:
+            return row
+        return self.view[row]
+
     @property
     def current(self):
         return self._current
@@ -388,8 +1641,8 @@ class Selection(Widget):
     def current(self, value):
         self._current = value
         try:
-            if self._current >= len(self.lict):
-                self._current = len(self.lict)-1
+            if self._current >= self.rows():
+                self._current = self.rows()-1
             elif self._current < 0:
                 self._current = 0
         except:
@@ -405,102 +1658,158 @@ class Selection(Widget):
         except:
             pass
 
-    # @property
-    # def filter(self):
-    #     return self._filter
-    #
-    # @filter.setter
-    # def filter(self, value):
-    #     self._filter = value
-    #     if value == '':
-    #         self.filtered = self.lict.list[:]
-    #         return
-    #     tagged = {}
-    #     wild = ''
-    #     for i in value.split(';'):
-    #         if ':' in i:
-    #             a, b = i.split(':')
-    #             tagged[a.lower()] = b.lower()
-    #         else:
-    #             wild = i
-    #     self.filtered = []
-    #     for i, j in self.lict.items():
-    #         if self.match(j.attributes, tagged, wild):
-    #             self.filtered.append(i)
-    #     self.current = 0
-    #     self.scroll = 0
+    @property
+    def filter(self):
+        return self._filter
+
+    @filter.setter
+    def filter(self, value):
+        # format: tag:value;tag:value;wild
+        self._filter = value
+        if value == '' or self.lict is None:
+            self.view = None
+            self.matched = None
+            self.current = self.current
+            return
+        tagged = {}
+        wild = ''
+        for i in value.split(';'):
+            if ':' in i:
+                a, b = i.split(':', 1)
+                tagged[a.strip().lower()] = b.lower()
+            else:
+                wild = i.lower()
+        query = (tagged, wild)
+        if isinstance(self.lict, Window):
+            return self.filter_window(query)
+        if self.tag_index is None:
+            self.tag_index = TagIndex(self.lict)
+        within = None
+        if self.matched is not None and self.refines(self.query, query):
+            within = self.matched # the query only grew, narrow down the previous result
+        keys = self.tag_index.search(tagged, wild, within)
+        self.query = query
+        self.matched = keys
+        self.view = [i for i, key in enumerate(self.lict) if key in keys]
+        self.current = self.current
+
+    def filter_window(self, query):
+        # mpd searches the queue in the background and the view changes once it
+        # answers. a query that only grew narrows the last answer here instead,
+        # when that was small enough to keep the songs of
+        old, self.query = self.query, query
+        if not query[0] and query[1] == '':
+            self.view = None
+            self.matched = None
+        elif self.matched is not None and self.matched[0] == self.lict.stamp and self.refines(old, query):
+            stamp, index, positions = self.matched
+            self.view = sorted(positions[key] for key in index.search(*query))
+        else:
+            stamp = self.lict.stamp
+            client.search_queue(*query, lambda songs: self.window_matched(query, stamp, songs))
+        self.current = self.current
+
+    def window_matched(self, query, stamp, songs):
+        if query != self.query or stamp != self.lict.stamp:
+            return # the filter or the queue changed while mpd was searching
+        positions = {song['id']: int(song['pos']) for song in songs}
+        self.lict.keep_found(stamp, songs[:self.narrow]) # enough to show without fetching pages
+        self.matched = None
+        if len(songs) <= self.narrow:
+            self.matched = (stamp, TagIndex(Lict({song['id']: song for song in songs})), positions)
+        self.view = sorted(positions.values())
+        self.current = self.current
+        if self in term.widgets:
+            for widget in term.widgets[term.widgets.index(self):]:
+                widget.display() # and whatever is drawn over it, the filter dialogue
+
+    def refines(self, old, new):
+        (old_tagged, old_wild), (new_tagged, new_wild) = old, new
+        if old_wild not in new_wild:
+            return False
+        return all(i in new_tagged and j in new_tagged[i] for i, j in old_tagged.items())
 
     def select(self):
-        if self.current != -1 and len(self.lict) > 0:
-            self.selected.append(self.current)
+        if self.current != -1 and self.rows() > 0:
+            self.selected.add(self.lict, [self.position(self.current)])
 
-    def match(self, thing, tagged, wild):
-        for i, j in tagged.items():
-            if j not in thing[i].lower():
-                return False
-        if wild != '':
-            wild_match = False
-            for i, j in thing.items():
-                if wild in j.lower():
-                    wild_match = True
-            return True and wild_match
-        return True
+    def select_all(self):
+        # every row shown, so with a filter on this selects whatever matches it
+        self.selected.add(self.lict, map(self.position, range(self.rows())))
 
-    def next(self):
+    def invert_selection(self):
+        self.selected.invert(self.lict, map(self.position, range(self.rows())))
+
+    def next(self, count=1):
         try:
-            self.current = (self.current + 1) % len(self.lict.list)
+            self.current = (self.current + count) % self.rows()
         except ZeroDivisionError:
             pass
 
-    def prev(self):
+    def prev(self, count=1):
         try:
-            self.current = (self.current - 1) % len(self.lict.list)
+            self.current = (self.current - count) % self.rows()
         except ZeroDivisionError:
             pass
 
     def display(self):
         if self.hide:
             return
-        self.update()
+        self.refresh()
         position, size = self.scaled_dimensions()
-        with term.location(*position):
-            i = 0
-            index = 0
-            self.current = self.current
-            for index in range(self.scroll, min(len(self.lict), self.scroll+size[1])):
-                try:
-                    thing = self.lict[index]
-                except IndexError:
-                    break
-                playing = (thing.get('id') == term.current_song) and (thing.get('id') is not None)
-                echo(term.ljust(term.draw(thing, size[0], self.formats, self.current == index, index in self.selected, playing), size[0]))
-                echo(term.move_down(1) + term.move_x(position[0]))
-                i += 1
-            for j in range(i, size[1]):
-                echo(' '*size[0])
-                echo(term.move_down(1) + term.move_x(position[0]))
+        x, y = position
+        i = 0
+        self.current = self.current
+        for row in range(self.scroll, min(self.rows(), self.scroll+size[1])):
+            index = self.position(row)
+            try:
+                thing = self.lict[index]
+            except IndexError:
+                break
+            playing = (thing.get('id') == term.current_song) and (thing.get('id') is not None)
+            term.screen.write(x, y+i, term.draw(thing, size[0], self.formats, self.current == row, index in self.selected, playing, self.lict.key(index)))
+            i += 1
+        for j in range(i, size[1]):
+            term.screen.write(x, y+j, ' '*size[0])
 
     def handle_input(self, inp):
         if inp.is_sequence:
             if inp.name == 'KEY_DOWN':
-                self.next()
+                self.next(term.repeat)
                 return self.redraw()
             elif inp.name == 'KEY_UP':
-                self.prev()
+                self.prev(term.repeat)
                 return self.redraw()
             elif inp.name == 'KEY_SDOWN':
                 self.select()
                 self.next()
                 return self.redraw()
+            elif inp.name == 'KEY_SUP':
+                self.select()
+                self.prev()
+                return self.redraw()
         else:
             if inp == '`':
-                if self.selected != []:
-                    self.selected = []
+                if self.selected:
+                    self.selected.clear()
                     return self.redraw()
+            elif inp == '*':
+                self.select_all()
+                return self.redraw()
+            elif inp == '~':
+                self.invert_selection()
+                return self.redraw()
+            elif inp == '/':
+                d = self.add_child(FilterDialogue(self.filter))
+                term.widgets.append(d)
+                term.focus(d)
+                return False
         return super().handle_input(inp)
 
 
 class PlaylistSelection(Selection):
+    subsystems = ('stored_playlist',)
+
     def __init__(self, lict=None, position='0.0+0;0.0+0', size='0.5+0;1.0-2'):
         super().__init__(lict, position, size)
         self.formats = [
@@ -508,9 +1817,9 @@ class PlaylistSelection(Selection):
             [('{name}', 'bold_red', 'l', 1.0)]
         ]
         self.pes = self.add_child(PlaylistEditorSelection(Lict({})))
-        if len(self.lict.list) > 0:
-            term.current_playlist = self.lict.list[0]
-        self.pes.update()
+        if len(self.lict) > 0:
+            term.current_playlist = self.lict.key(0)
+        self.pes.invalidate()
 
     def focus(self):
         self.pes._position = '0.5+0;0.0+0'
@@ -519,18 +1828,20 @@ class PlaylistSelection(Selection):
         self.pes.display()
         self.pes.display_shell()
 
-    def next(self):
-        super().next()
-        if len(self.lict.list) > 0:
-            term.current_playlist = self.lict.list[self.current]
+    def next(self, count=1):
+        super().next(count)
+        if self.rows() > 0:
+            term.current_playlist = self.lict.key(self.position(self.current))
             self.pes.current = 0
+            self.pes.invalidate()
         self.pes.display()
 
-    def prev(self):
-        super().prev()
-        if len(self.lict.list) > 0:
-            term.current_playlist = self.lict.list[self.current]
+    def prev(self, count=1):
+        super().prev(count)
+        if self.rows() > 0:
+            term.current_playlist = self.lict.key(self.position(self.current))
             self.pes.current = 0
+            self.pes.invalidate()
         self.pes.display()
 
     def update(self):
@@ -538,10 +1849,10 @@ class PlaylistSelection(Selection):
 
     def handle_input(self, inp):
         if inp.is_sequence:
-            if inp.name == 'KEY_SDOWN':
-                return None
+            if inp.name in ('KEY_SDOWN', 'KEY_SUP'):
+                return None # nothing to do with marked playlists, so they can't be marked
             elif inp.name == 'KEY_RIGHT':
-                if len(self.lict.list) == 0:
+                if self.rows() == 0:
                     return None
                 self.pes._position = '0.0+0;0.0+0'
                 # term.focus(self.pes)
@@ -570,14 +1881,18 @@ class PlaylistSelection(Selection):
 
     def delete_playlist(self):
         client.delete_playlist(term.current_playlist)
-        self.update()
-        if len(self.lict.list) > 0:
-            term.current_playlist = self.lict.list[self.current]
+        self.invalidate()
+        self.refresh()
+        if self.rows() > 0:
+            term.current_playlist = self.lict.key(self.position(self.current))
             self.pes.current = 0
+            self.pes.invalidate()
         # self.pes.display()
 
 
 class PlaylistEditorSelection(Selection):
+    subsystems = ('stored_playlist',)
+
     def __init__(self, lict=None, position='0.5+0;0.0+0', size='0.5+0;1.0-2'):
         super().__init__(lict, position, size)
         self.field = self.add_child(FilterField('', '0.5+0;0.0+0', '0.5+0;0.0+3'))
@@ -597,27 +1912,24 @@ class PlaylistEditorSelection(Selection):
     def handle_input(self, inp):
         if inp.is_sequence:
             if inp.name == 'KEY_ENTER':
-                if self.selected != []:
-                    for index in self.selected:
-                        client.queue_song(self.lict[index]['file'])
-                    self.selected = []
+                if self.selected:
+                    with client.batch() as batch:
+                        for index in self.selected:
+                            batch.add(self.lict[index]['file'])
+                    self.selected.clear()
                 else:
-                    if len(self.lict.list) > 0:
-                        client.queue_song(self.lict[self.current]['file'])
+                    if self.rows() > 0:
+                        client.queue_song(self.lict[self.position(self.current)]['file'])
             if inp.name == 'KEY_DELETE':
-                if self.selected != []:
-                    i = 0
-                    self.selected.sort()
-                    for index in self.selected:
-                        client.delete_from_playlist(term.current_playlist, index-i)
-                        self.lict.delete(index-i)
-                        i += 1
-                    self.selected = []
+                # the client edits its cached copy, which is what's shown here
+                if self.selected:
+                    client.delete_from_playlist(term.current_playlist, to_ranges(self.selected))
+                    self.selected.clear()
                 else:
-                    if len(self.lict.list) > 0:
-                        client.delete_from_playlist(term.current_playlist, self.current)
-                        self.lict.delete(self.current)
-                        self.current = self.current
+                    if self.rows() > 0:
+                        index = self.position(self.current)
+                        client.delete_from_playlist(term.current_playlist, [(index, index+1)])
+                self.invalidate()
                 return self.redraw()
             elif inp.name == 'KEY_LEFT':
                 self._position = '0.5+0;0.0+0'
@@ -629,8 +1941,8 @@ class PlaylistEditorSelection(Selection):
                 return self.redraw()
         else:
             if inp == '`':
-                if self.selected != []:
-                    self.selected = []
+                if self.selected:
+                    self.selected.clear()
                     return self.redraw()
                 self._position = '0.5+0;0.0+0'
                 term.focus(self.parent)
@@ -647,12 +1959,22 @@ class PlaylistEditorSelection(Selection):
 
 
 class SongSelection(Selection):
+    subsystems = ('database',)
+
     def __init__(self, search, position='0.5+0;0.0+0', size='0.5+0;1.0-1'):
-        self.search = search
-        super().__init__(None, position, size)
+        self.search = None
+        super().__init__(Lict({}), position, size)
+        self.search = search # searched when it's first shown, it may never be
+        self.invalidate()
 
     def update(self):
-        self.lict = client.search_songs(self.search)
+        if self.search is not None:
+            client.search_songs(self.search, self.show_results)
+
+    def show_results(self, lict):
+        self.lict = lict
+        if self in term.widgets:
+            self.display()
 
     def handle_input(self, inp):
         if inp.is_sequence:
@@ -660,27 +1982,28 @@ class SongSelection(Selection):
                 term.focus(self.pair)
                 return
             elif inp.name == 'KEY_ENTER':
-                if self.selected != []:
-                    for index in self.selected:
-                        client.queue_song(self.lict[index]['file'])
-                    self.selected = []
+                if self.selected:
+                    with client.batch() as batch:
+                        for index in self.selected:
+                            batch.add(self.lict[index]['file'])
+                    self.selected.clear()
                 else:
-                    if len(self.lict.list) > 0:
-                        client.queue_song(self.lict[self.current]['file'])
+                    if self.rows() > 0:
+                        client.queue_song(self.lict[self.position(self.current)]['file'])
             elif inp.name == 'KEY_LEFT':
                 term.focus(self.parent)
                 return self.redraw()
         else:
             if inp in ('=', '+'):
                 tba = []
-                if self.selected != []:
+                if self.selected:
                     for i in self.selected:
                         tba.append(self.lict[i])
                 else:
-                    if len(self.lict) > 0:
-                        tba = [self.lict[self.current]]
-                for song in tba:
-                    client.add_to_playlist(term.current_playlist, song['file'])
+                    if self.rows() > 0:
+                        tba = [self.lict[self.position(self.current)]]
+                client.add_to_playlist(term.current_playlist, tba)
+                self.parent.invalidate()
                 self.parent.display()
                 # self.parent.filter = self.parent.filter
                 return False
@@ -723,9 +2046,7 @@ class TextField(Widget):
         if self.hide:
             return
         position, size = self.scaled_dimensions()
-        with term.location(*position):
-            # echo(self.text + term.on_white + ' '*(size[0]-len(self.text)))
-            echo(self.draw())
+        term.screen.write(*position, self.draw())
 
 
 class FilterField(TextField):
@@ -741,6 +2062,7 @@ class FilterField(TextField):
         self._text = value
         try:
             self.pair.search = value
+            self.pair.invalidate()
             self.pair.display()
         except AttributeError:
             pass
@@ -794,7 +2116,7 @@ class Dialogue(Widget):
     def __init__(self, text, options=None, options_selected=0, callbacks=None, position='0.25+0;0.5-3', size='0.5+0;0.0+6'):
         super().__init__(position, size)
         self.text = text
-        sx, sy = self.interpret(size)
+        sx, sy = Extent.parse(size).axes
         self.field_size = f'{sx[0]}{sx[1]-2:+};0.0+1'
 
         self.fields = [Radio(options, options_selected, size=self.field_size)]
@@ -816,20 +2138,21 @@ class Dialogue(Widget):
         if self.hide:
             return
         position, size = self.scaled_dimensions()
-        with term.location(*position):
-            i = 0
-            for line in term.wrap(self.text, size[0]):
-                i += 1
-                echo(term.ljust(line, size[0]) + term.move_down(1) + term.move_x(position[0]))
-            for k, field in enumerate(self.fields[:-1]):
-                if k == self.current:
-                    field.focused = True
-                echo(field.draw() + term.move_down(1) + term.move_x(position[0]))
-            for j in range(i, size[1]-len(self.fields)):
-                echo(' '*size[0] + term.move_down(1) + term.move_x(position[0]))
-            if self.current == len(self.fields)-1:
-                self.fields[-1].focused = True
-            echo(self.fields[-1].draw()) # draw radio at bottom
+        x, y = position
+        i = 0
+        for line in term.wrap(self.text, size[0]):
+            term.screen.write(x, y+i, term.ljust(line, size[0]))
+            i += 1
+        for k, field in enumerate(self.fields[:-1]):
+            if k == self.current:
+                field.focused = True
+            term.screen.write(x, y+i, field.draw())
+            i += 1
+        for j in range(i, size[1]-1):
+            term.screen.write(x, y+j, ' '*size[0])
+        if self.current == len(self.fields)-1:
+            self.fields[-1].focused = True
+        term.screen.write(x, y+size[1]-1, self.fields[-1].draw()) # draw radio at bottom
 
     def handle(self):
         current = self.fields[-1].current
@@ -883,13 +2206,65 @@ class CreatePlaylistDialogue(Dialogue):
             term.focus(d)
 
 
+class FilterDialogue(Dialogue):
+    def __init__(self, filter, position='0.25+0;0.5-3', size='0.5+0;0.0+6'):
+        super().__init__('Filter, e.g. artist:bach;prelude', ['ok', 'clear'], 0, position=position, size=size)
+        self.fields = [TextField(filter, position=position, size=self.field_size)] + self.fields
+
+    def handle(self):
+        if self.fields[-1].current == 1:
+            self.parent.filter = ''
+        term.focus(self.parent)
+
+    def handle_input(self, inp):
+        status = super().handle_input(inp)
+        if self in term.widgets and self.fields[0].text != self.parent.filter:
+            # filter as you type
+            self.parent.filter = self.fields[0].text
+            self.parent.display()
+            self.display()
+        return status
+
+
+class StatsOverlay(Widget):
+    # what the client has asked mpd for so far, any key but ` and i updates it
+    def __init__(self, position='0.1+0;0.1+0', size='0.8+0;0.8+0'):
+        super().__init__(position, size)
+
+    def display(self):
+        if self.hide:
+            return
+        position, size = self.scaled_dimensions()
+        x, y = position
+        lines = client.meter.lines()
+        for i in range(size[1]):
+            line = lines[i] if i < len(lines) else ''
+            term.screen.write(x, y+i, term.ljust(text_truncate(line, size[0]), size[0]))
+
+    def handle_input(self, inp):
+        if inp in ('`', 'i'):
+            term.widgets.remove(self)
+            term.focus(self.parent)
+            term.display()
+            return False
+        return self.redraw()
+
+
 class StatusWidget(Widget):
     def __init__(self, position='0.0+0;1.0-2', size='1.0+0;0.0+2'):
         super().__init__(position, size, bordered=False)
-        self.image = pixcat.Image('./placeholder.jpg')
+        self._placeholder = None
+        self.image = None # the placeholder until a cover is looked up
+        self.shown = (None, None) # last cover and the pixcat image made of it
+        self.upcoming = None
+        self.info = {}
+        self.song = {}
+        self.anchor = (0, 0) # elapsed as of the last status, and when that was
+        self.drawn = None # progress the bar and clock last showed
 
     def update(self):
         self.info = client.get_status()
+        self.anchor = (float(self.info.get('elapsed', 0)), time.monotonic())
         self.song = client.get_playing()
         
         if term.current_song != self.info.get('songid'):
@@ -898,28 +2273,65 @@ class StatusWidget(Widget):
                 term.queue.display()
             elif term.mode == 'pretty_print':
                 self.update_image()
+        if term.mode == 'pretty_print':
+            self.prefetch()
+
+    # pixcat is imported here on the ui thread, the first time pretty_print
+    # mode shows a cover. importing it sets a signal handler, which only the
+    # main thread can do
+    @property
+    def placeholder(self):
+        if self._placeholder is None:
+            import pixcat
+            self._placeholder = pixcat.Image(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'placeholder.jpg'))
+        return self._placeholder
+
+    def prefetch(self):
+        # get the next covers ready while this song plays, so they show up with the title
+        if self.info.get('nextsong') is None:
+            return
+        upcoming = (self.info.get('nextsongid'), self.info.get('playlist'), self.info.get('random'), self.image_size()[0])
+        if upcoming != self.upcoming:
+            self.upcoming = upcoming
+            term.art.prefetch(self.info, upcoming[-1])
+
+    def picture(self, image):
+        if image is None:
+            return self.placeholder
+        if self.shown[0] is not image:
+            import pixcat
+            self.shown = (image, pixcat.Image(image))
+        return self.shown[1]
 
     def update_image(self):
-        if self.info.get('state') in ('stop', None):
-            self.image = pixcat.Image('./placeholder.jpg')
-        else:
-            try:
-                self.imagelink = os.popen('songinfo').read()
-                self.image = pixcat.Image(self.imagelink)
-                # self.image = pixcat.Image('./placeholder.jpg')
-            except:
-                self.image = pixcat.Image('./placeholder.jpg')
+        self.image = self.placeholder
+        if self.info.get('state') not in ('stop', None) and 'file' in self.song:
+            found, image = term.art.cached(self.song, self.image_size()[0])
+            if found:
+                self.image = self.picture(image)
+            else:
+                term.art.fetch(self.song, self.image_size()[0], self.show_image)
         self.display_image()
 
-    def display_image(self):
-        if term.mode != 'pretty_print':
-            return
-        position, size = self.scaled_dimensions()
+    def show_image(self, result):
+        song, image = result
+        if image is not None and song.get('file') == self.song.get('file'):
+            self.image = self.picture(image)
+            self.display_image()
 
-        w, h = TERM.cell_px_width, TERM.cell_px_height
+    def image_size(self):
+        # side of the cover in pixels, and in cells of each direction
+        _, size = self.scaled_dimensions()
+        w, h = term.cell_size
         i_cell_size = size[1]//2
         i_size = h*i_cell_size
-        i_other_cell_size = i_size//w
+        return i_size, i_size//w, i_cell_size
+
+    def display_image(self):
+        if term.mode != 'pretty_print' or term.headless:
+            return
+        position, size = self.scaled_dimensions()
+        i_size, i_other_cell_size, i_cell_size = self.image_size()
         # with term.location(position[0]-i, position[1]-i):
         # self.image = self.image.resize(size[0], size[0])
         # self.image.thumbnail(i_size, stretch=True).show((position[0]+size[0])//2, position[1]-size[0]//2)
@@ -933,82 +2345,136 @@ class StatusWidget(Widget):
         term.widgets = []
 
     def defocus(self):
-        self.image.hide()
+        if self.image is not None and not term.headless:
+            self.image.hide()
         super().defocus()
 
-    def display(self):
-        self.update()
+    def display(self, refresh=True):
+        if refresh:
+            try:
+                self.update()
+            except Offline as e:
+                return self.display_offline(str(e))
         if term.mode != 'pretty_print':
             self.display_regular()
         else:
             self.display_fancy()
+        _, size = self.scaled_dimensions()
+        self.drawn = self.progress(size[0])
+
+    def tick(self):
+        # between status updates the bar and clock move on locally. nothing is
+        # drawn until one of them changes, and then the screen only sends the
+        # cells that came out different
+        _, size = self.scaled_dimensions()
+        if self.progress(size[0]) != self.drawn:
+            self.display(refresh=False)
+
+    def elapsed(self):
+        elapsed, at = self.anchor
+        if self.info.get('state') == 'play':
+            elapsed += time.monotonic() - at
+        if (duration := self.info.get('duration')) is not None:
+            elapsed = min(elapsed, float(duration))
+        return elapsed
+
+    def progress(self, twidth):
+        # filled cells of the bar and whole seconds on the clock
+        elapsed = self.elapsed()
+        if not float(self.info.get('duration', 0)):
+            return None, int(elapsed)
+        return int(elapsed/float(self.info['duration'])*twidth), int(elapsed)
+
+    def next_tick(self):
+        # seconds until the bar fills another cell or the clock shows another second
+        if self.info.get('state') != 'play' or not float(self.info.get('duration', 0)):
+            return None
+        _, size = self.scaled_dimensions()
+        elapsed = self.elapsed()
+        step = float(self.info['duration'])/size[0]
+        waits = [step - elapsed % step]
+        if term.mode != 'pretty_print':
+            waits.append(1 - elapsed % 1)
+        return min(waits) + 0.001 # land just past the change, not just short of it
 
     def get_bar(self, twidth):
-        if (elapsed := self.info.get('elapsed')) is not None and (duration := self.info.get('duration')) is not None:
-            width = int(float(elapsed)/float(duration)*twidth)
-            bar = term.red + '─'*width + term.white + '─'*(twidth-width)
-        else:
+        width, _ = self.progress(twidth)
+        if width is None:
             return term.white + '─'*twidth + term.normal
-        return bar + term.normal
+        return term.red + '─'*width + term.white + '─'*(twidth-width) + term.normal
 
     def display_fancy(self):
         position, size = self.scaled_dimensions()
-        with term.location(*position):
-            echo(term.center(self.get_bar(size[0]), size[0]) + term.move_down(1) + term.move_x(position[0]))
-            line = ''
-            if (state := self.info.get('state')) == 'stop':
-                echo(term.center(f'{term.bold}Stopped{term.normal}', size[0]) + term.move_down(1) + term.move_x(position[0]))
-                echo(' '*size[0])
-                return
-            elif state == 'pause':
-                line += f'{term.bold}Paused ─ {term.normal}'
-            if (title := self.song.get('title')) is None:
-                title = self.song['file']
-            line += f'{term.red} {title}{term.normal}'
-            if term.length(line) > size[0]:
-                line = term.truncate(line, size[0]-3) + '...'
-            echo(term.center(line, size[0]) + term.move_down(1) + term.move_x(position[0]))
-            line = ''
-            if (artist := self.song.get('artist')) is not None:
-                line += f'{term.yellow} {artist}{term.normal}'
-            if (album := self.song.get('album')) is not None:
-                if line != '':
-                    line += ' ─ '
-                line += f'{term.magenta} {album}{term.normal}'
-                if (track := self.song.get('track')) is not None:
-                    line += f' {term.white}(#{track}){term.normal}'
-            if term.length(line) > size[0]:
-                line = term.truncate(line, size[0]-3) + '...'
-            echo(term.center(line, size[0]))
+        x, y = position
+        term.screen.write(x, y, term.center(self.get_bar(size[0]), size[0]))
+        line = ''
+        if (state := self.info.get('state')) == 'stop':
+            term.screen.write(x, y+1, term.center(f'{term.bold}Stopped{term.normal}', size[0]))
+            term.screen.write(x, y+2, ' '*size[0])
+            return
+        elif state == 'pause':
+            line += f'{term.bold}Paused ─ {term.normal}'
+        if (title := self.song.get('title')) is None:
+            title = self.song['file']
+        line += f'{term.red} {title}{term.normal}'
+        if term.length(line) > size[0]:
+            line = term.truncate(line, size[0]-3) + '...'
+        term.screen.write(x, y+1, term.center(line, size[0]))
+        line = ''
+        if (artist := self.song.get('artist')) is not None:
+            line += f'{term.yellow} {artist}{term.normal}'
+        if (album := self.song.get('album')) is not None:
+            if line != '':
+                line += ' ─ '
+            line += f'{term.magenta} {album}{term.normal}'
+            if (track := self.song.get('track')) is not None:
+                line += f' {term.white}(#{track}){term.normal}'
+        if term.length(line) > size[0]:
+            line = term.truncate(line, size[0]-3) + '...'
+        term.screen.write(x, y+2, term.center(line, size[0]))
+
+    def display_offline(self, message):
+        # the last song stays up, the line under the bar says why nothing happens
+        position, size = self.scaled_dimensions()
+        x, y = position
+        line = f'{term.bold}{message}{term.normal}'
+        if term.length(line) > size[0]:
+            line = term.truncate(line, size[0]-3) + '...'
+        if term.mode == 'pretty_print':
+            term.screen.write(x, y+1, term.center(line, size[0]))
+        else:
+            term.screen.write(x, y+1, term.ljust(line, size[0]))
 
     def display_regular(self):
         position, size = self.scaled_dimensions()
-        with term.location(*position):
-            echo(self.get_bar(size[0]) + term.move_down(1) + term.move_x(position[0]))
-            now_playing = ''
-            if (state := self.info.get('state')) == 'stop':
-                now_playing = f'{term.bold}Stopped{term.normal}'
-            else:
-                if state == 'pause':
-                    now_playing += f'{term.bold}Paused: {term.normal}'
-                if (title := self.song.get('title')) is None:
-                    title = self.song['file']
-                now_playing += term.red + title + term.normal
-                if (artist := self.song.get('artist')) is not None:
-                    now_playing += f' by {term.yellow}{artist}{term.normal}'
-                stamps = ''
-                if self.info.get('random') == '1':
-                    stamps += ''
-                if self.info.get('repeat') == '1':
-                    stamps += ''
-                stamps += f'{term.bold}{to_timestamp(float(self.info.get("elapsed")))}/{to_timestamp(float(self.info.get("duration")))}{term.normal}'
-                spaces = ' '*(size[0] - term.length(stamps) - term.length(now_playing))
-                now_playing = now_playing + spaces + stamps
-            echo(term.ljust(now_playing, size[0]))
+        x, y = position
+        term.screen.write(x, y, self.get_bar(size[0]))
+        now_playing = ''
+        if (state := self.info.get('state')) == 'stop':
+            now_playing = f'{term.bold}Stopped{term.normal}'
+        else:
+            if state == 'pause':
+                now_playing += f'{term.bold}Paused: {term.normal}'
+            if (title := self.song.get('title')) is None:
+                title = self.song['file']
+            now_playing += term.red + title + term.normal
+            if (artist := self.song.get('artist')) is not None:
+                now_playing += f' by {term.yellow}{artist}{term.normal}'
+            stamps = ''
+            if self.info.get('random') == '1':
+                stamps += ''
+            if self.info.get('repeat') == '1':
+                stamps += ''
+            stamps += f'{term.bold}{to_timestamp(self.elapsed())}/{to_timestamp(float(self.info.get("duration")))}{term.normal}'
+            spaces = ' '*(size[0] - term.length(stamps) - term.length(now_playing))
+            now_playing = now_playing + spaces + stamps
+        term.screen.write(x, y+1, term.ljust(now_playing, size[0]))
 
 
 
 class Queue(Selection):
+    subsystems = ('playlist',)
+
     def __init__(self, position='0.0+0;0.0+0', size='1.0+0;1.0-2'):
         super().__init__(None, position, size, bordered=False)
         self.formats = [
@@ -1030,32 +2496,142 @@ class Queue(Selection):
                 self.next()
                 return self.redraw()
             if inp.name == 'KEY_ENTER':
-                if self.selected != []:
+                if self.selected:
                     return None
                 else:
-                    if len(self.lict.list) > 0:
-                        client.play_from_queue(self.lict[self.current]['id'])
+                    if self.rows() > 0:
+                        client.play_from_queue(self.lict[self.position(self.current)]['id'])
                         term.status.update()
             elif inp.name == 'KEY_DELETE':
-                if self.selected != []:
-                    i = 0
-                    self.selected.sort()
-                    for index in self.selected:
-                        client.dequeue(index-i)
-                        self.lict.delete(index-i)
-                        i += 1
-                    self.selected = []
+                if self.selected:
+                    # songs by id where they're known, so a queue that moved meanwhile
+                    # loses the marked songs rather than whatever is at their old rows.
+                    # positions go first, while the ids are still where they were
+                    ranges = to_ranges(self.selected)
+                    positions, ids = self.selected.marked()
+                    with client.batch() as batch:
+                        for start, end in reversed(to_ranges(positions)):
+                            batch.delete((start, end))
+                        for id in ids:
+                            batch.deleteid(id)
+                    self.lict.delete_ranges(ranges)
+                    self.selected.clear() # before changed, so the deleted marks aren't looked for
+                    self.changed()
+                    if any(isinstance(result, mpd.CommandError) for result in batch.results):
+                        client.queue = None # local copy no longer matches, reload it
+                        self.invalidate()
                 else:
-                    if len(self.lict.list) > 0:
-                        client.dequeue(self.current)
-                        self.lict.delete(self.current)
-                        self.current = self.current
+                    if self.rows() > 0:
+                        index = self.position(self.current)
+                        client.dequeue(index)
+                        self.lict.delete(index)
+                        self.changed()
                 return self.redraw()
         return super().handle_input(inp)
 
 
+class Screen():
+    # off-screen copy of the terminal. widgets compose a frame here and flush
+    # only writes the cells that differ from what is already on screen
+    sequence = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]|\x1b[()][0-9A-Za-z]|\x1b.')
+    gap = 4 # rewriting a few unchanged cells is cheaper than moving the cursor
+
+    def __init__(self, term):
+        self.term = term
+        self.resize()
+
+    def resize(self):
+        self.height, self.width = self.term.sizing
+        self.cells = [[(' ', '')]*self.width for _ in range(self.height)]
+        self.shown = None # nothing known about the terminal, paint everything
+        self.changed = True
+
+    def text(self):
+        # what the frame reads as, one string per row
+        return [''.join(char for char, attr in row) for row in self.cells]
+
+    def clear(self):
+        for row in self.cells:
+            row[:] = [(' ', '')]*self.width
+        self.changed = True
+
+    def write(self, x, y, text):
+        # text may carry styling but no cursor movement
+        if not 0 <= y < self.height:
+            return
+        self.changed = True
+        row = self.cells[y]
+        attr = ''
+        i = 0
+        for match in self.sequence.finditer(text + '\x1b[m'):
+            for char in text[i:match.start()]:
+                width = wcwidth(char)
+                if width < 0:
+                    continue
+                if width == 0 and x > 0:
+                    row[x-1] = (row[x-1][0] + char, attr) # combining character
+                    continue
+                if x+max(width, 1) > self.width:
+                    return
+                if x >= 0:
+                    row[x] = (char, attr)
+                    if width == 2:
+                        row[x+1] = ('', attr)
+                x += max(width, 1)
+            i = match.end()
+            seq = match.group()
+            if seq in ('\x1b[m', '\x1b[0m'):
+                attr = ''
+            elif seq.endswith('m'):
+                attr += seq
+
+    def flush(self):
+        out = []
+        if self.shown is None:
+            out.append(self.term.clear)
+        attr = None
+        for y, row in enumerate(self.cells):
+            old = None if self.shown is None else self.shown[y]
+            if old == row:
+                continue
+            x = 0
+            while x < self.width:
+                if old is not None and old[x] == row[x]:
+                    x += 1
+                    continue
+                start = x
+                if row[x][0] == '' and x > 0:
+                    start -= 1 # second half of a wide character
+                end = x + 1 # one past the last changed cell of this run
+                x += 1
+                while x < self.width and x - end <= self.gap:
+                    if old is None or old[x] != row[x]:
+                        end = x + 1
+                    x += 1
+                out.append(self.term.move_yx(y, start))
+                for char, a in row[start:end]:
+                    if a != attr:
+                        out.append(self.term.normal + a)
+                        attr = a
+                    out.append(char)
+                x = end
+        if out:
+            out.append(self.term.normal)
+            self.term.stream.write(''.join(out))
+            self.term.stream.flush()
+        self.shown = [row[:] for row in self.cells]
+        self.changed = False
+
+
 class PlayerTerminal(blessed.Terminal):
-    def __init__(self, *args, **kwargs):
+    moves = ('KEY_DOWN', 'KEY_UP') # keys that add up when several are waiting
+
+    def __init__(self, *args, fps=60, size=None, **kwargs):
+        # size (width, height) makes it headless: frames are composed into
+        # self.screen and flushed into a string buffer, keys come from press
+        self.size = size
+        if self.headless:
+            kwargs.update(kind='xterm-256color', stream=io.StringIO(), force_styling=True)
         super().__init__(*args, **kwargs)
         self.mode = ''
         self.current_playlist = None
@@ -1063,45 +2639,157 @@ class PlayerTerminal(blessed.Terminal):
 
         self.current_widget = None
         self.widgets = []
+        self.sizing = (self.height, self.width)
+        self.screen = Screen(self)
+        self.rows = {} # row cache for draw, in lru order
+        self.row_cache_size = 2048
+
+        self.fps = fps # most screen flushes a second
+        self.flushed = 0
+        self.keys = deque() # read but not handled yet
+        self.repeat = 1 # how many times the key being handled was pressed
+
+        self.wakeup = os.pipe()
+        os.set_blocking(self.wakeup[1], False)
+
+    @property
+    def headless(self):
+        return self.size is not None
+
+    @property
+    def width(self):
+        return super().width if self.size is None else self.size[0]
+
+    @property
+    def height(self):
+        return super().height if self.size is None else self.size[1]
+
+    @property
+    def cell_size(self):
+        # pixels a cell takes up, which covers are sized by. made up when headless
+        if self.headless:
+            return 8, 16
+        from pixcat.terminal import TERM
+        return TERM.cell_px_width, TERM.cell_px_height
 
     def launch(self):
-        self.playlist_selection = PlaylistSelection()
+        # only what the queue needs, the other modes are built when first shown
+        self.art = ArtCache()
+        self.playlist_selection = None
         self.status = StatusWidget()
         self.queue = Queue()
         self.set_mode('queue')
-        self.status.display()
 
-    def draw(self, d, twidth, formats=None, hovered=False, selected=False, playing=False):
-        if isinstance(d, Lict):
-            d = Lict.dict
-        string = ''
-        rwidth = 0 # running total of width
-        format = formats[0]
-        if playing:
-            format = formats[1]
-        for i, (section, style, alignment, frac) in enumerate(format):
-            if hovered:
-                string += (self.bold)
-            if selected:
-                string += (self.reverse)
-            text = section.format(**d)
-            if i == len(format)-1:
-                width = twidth - rwidth
+    def draw(self, d, twidth, formats, hovered=False, selected=False, playing=False, key=None):
+        # rows are cached by song key, so scrolling mostly reuses finished rows.
+        # a changed song gets a new dict, which is checked by identity on a hit
+        if key is None:
+            return formats.render(d, twidth, hovered, selected, playing)
+        cache_key = (formats, key, client.versions['database'], twidth, hovered, selected, playing)
+        hit = self.rows.pop(cache_key, None)
+        if hit is None or hit[0] is not d:
+            hit = (d, formats.render(d, twidth, hovered, selected, playing))
+        self.rows[cache_key] = hit # most recently used last
+        if len(self.rows) > self.row_cache_size:
+            del self.rows[next(iter(self.rows))]
+        return hit[1]
+
+    def wait(self):
+        # block until a key arrives, mpd reports a change or the window is resized.
+        # whatever was typed meanwhile is handled before the screen is flushed, and
+        # flushes are spaced out to the frame rate
+        while True:
+            while inp := self.inkey(timeout=0):
+                self.keys.append(inp)
+            if self.keys:
+                return self.next_key()
+            frame = None
+            if self.screen.changed:
+                frame = self.flushed + 1/self.fps - time.monotonic()
+                if frame <= 0:
+                    self.screen.flush()
+                    self.flushed = time.monotonic()
+                    frame = None
+            if client.down:
+                timeout = min(1, max(0, client.retry_at - time.monotonic())) # count down to the next attempt
             else:
-                width = int(frac*twidth)
-                rwidth += (width + 1)
-            if self.length(text) > width:
-                text = self.truncate(text, width-3) + '...'
-            if alignment == 'l':
-                string += getattr(self, style) + (self.ljust(text, width))
-            elif alignment == 'c':
-                string += getattr(self, style) + (self.center(text, width))
-            elif alignment == 'r':
-                string += getattr(self, style) + (self.rjust(text, width))
-            if i != len(format)-1:
-                string += ' '
-            string += (self.normal)
-        return string
+                timeout = self.status.next_tick() # when the bar or clock moves next
+            if frame is not None:
+                timeout = frame if timeout is None else min(timeout, frame)
+            ready, _, _ = select.select([self._keyboard_fd, self.wakeup[0]], [], [], timeout)
+            if ready == [] and frame is not None:
+                continue # time to flush
+            if ready == [] and client.down:
+                self.status.display() # retries the connection once it's due
+                if not client.down:
+                    self.display()
+            elif ready == []:
+                self.status.tick()
+            if self.wakeup[0] in ready:
+                self.woken()
+
+    def woken(self):
+        os.read(self.wakeup[0], 1024)
+        self.resize()
+        if changed := client.fetch_changes():
+            self.handle_changes(changed)
+        client.pool.deliver()
+
+    def press(self, keys):
+        # headless input: keys are handled as though they were typed all at once,
+        # then the frame is flushed. True once one of them quits
+        self.ungetch(keys)
+        while inp := self.inkey(timeout=0):
+            self.keys.append(inp)
+        while self.keys:
+            try:
+                if self.handle_input(self.next_key()) == True:
+                    self.keys.clear()
+                    return True
+            except Offline as e:
+                self.status.display_offline(str(e))
+        self.settle()
+        return False
+
+    def settle(self, timeout=0):
+        # headless: take in what mpd and the pool send over the next timeout
+        # seconds, then flush the frame
+        deadline = time.monotonic() + timeout
+        while select.select([self.wakeup[0]], [], [], max(0, deadline - time.monotonic()))[0]:
+            self.woken()
+        self.screen.flush()
+
+    def next_key(self):
+        # a run of the same cursor move is handled as one move that many rows long
+        inp = self.keys.popleft()
+        self.repeat = 1
+        if inp.name in self.moves and isinstance(self.current_widget, Selection):
+            while self.keys and self.keys[0].name == inp.name:
+                self.keys.popleft()
+                self.repeat += 1
+        return inp
+
+    def wake(self):
+        try:
+            os.write(self.wakeup[1], b'\0')
+        except BlockingIOError:
+            pass # already pending
+
+    def handle_changes(self, changed):
+        if 'database' in changed:
+            client.refresh_library()
+        if changed & {'player', 'options'}:
+            self.status.display()
+        if changed & {'playlist', 'stored_playlist', 'database'}:
+            for widget in self.widgets:
+                widget.display()
+
+    def resize(self):
+        sizing = (self.height, self.width)
+        if self.sizing != sizing:
+            self.sizing = sizing # layouts are worked out from this
+            self.screen.resize()
+            self.display()
 
     def handle_input(self, inp):
         status = self.current_widget.handle_input(inp)
@@ -1122,11 +2810,18 @@ class PlayerTerminal(blessed.Terminal):
                     client.toggle_random()
                 elif inp == 'r':
                     client.toggle_repeat()
+                elif inp == 'i':
+                    overlay = self.current_widget.add_child(StatsOverlay())
+                    self.widgets.append(overlay)
+                    self.focus(overlay)
         return status
 
     def set_mode(self, mode):
         if self.mode == mode:
             return
+        if mode == 'playlists' and self.playlist_selection is None:
+            # before the mode changes, so an Offline here leaves it as it was
+            self.playlist_selection = PlaylistSelection()
         self.mode = mode
         if mode == 'queue':
             self.focus(self.queue)
@@ -1137,7 +2832,7 @@ class PlayerTerminal(blessed.Terminal):
             self.status._position = '0.1+0;0.7+0'
             self.status._size = '0.8+0;1.0+0'
             self.status.display_info = True
-            print(self.clear)
+            self.screen.clear()
             self.current_widget = self.status
             self.status.focus()
             self.status.display()
@@ -1169,21 +2864,54 @@ class PlayerTerminal(blessed.Terminal):
             self.status.update_image()
 
 
-term = PlayerTerminal()
-client = Client(6600)
+def positive(value):
+    value = float(value)
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f'has to be above 0, not {value:g}')
+    return value
 
-key_codes = term.get_keyboard_codes()
 
-inp = None
-sizing = (term.height, term.width)
-with term.hidden_cursor(), term.fullscreen(), term.cbreak():
+def headless(width=120, height=40, port=6600, mirror=False):
+    # a player that draws into term.screen instead of the terminal and is driven
+    # with term.press, for timing widgets without a tty
+    global term, client
+    term = PlayerTerminal(size=(width, height))
+    client = Client(port, mirror=mirror, wake=term.wake)
     term.launch()
-    status = False
-    while status != True:
-        inp = term.inkey(timeout=0.5)
-        term.status.display()
-        if sizing != (term.height, term.width):
-            print(term.clear)
-            term.display()
-        sizing = (term.height, term.width)
-        status = term.handle_input(inp)
+    term.settle()
+    return term
+
+
+def main():
+    global term, client
+    parser = argparse.ArgumentParser(description='simple mpd client')
+    parser.add_argument('--port', type=int, default=6600, help='port mpd listens on')
+    parser.add_argument('--mirror', action='store_true', help='keep a copy of the library in memory and search it locally')
+    parser.add_argument('--fps', type=positive, default=60, help='most times a second the screen is redrawn')
+    parser.add_argument('--stats', metavar='FILE', help='append what was asked of mpd to FILE as a json line on exit')
+    args = parser.parse_args()
+    stats_path = args.stats or os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'muspyl', 'stats.jsonl')
+
+    term = PlayerTerminal(fps=args.fps)
+    client = Client(args.port, mirror=args.mirror, wake=term.wake)
+
+    signal.set_wakeup_fd(term.wakeup[1])
+    signal.signal(signal.SIGWINCH, lambda signum, frame: None)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: client.meter.dump(stats_path))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit()) # leave the terminal as it was found
+    try:
+        with term.hidden_cursor(), term.fullscreen(), term.cbreak():
+            term.launch()
+            status = False
+            while status != True:
+                try:
+                    status = term.handle_input(term.wait())
+                except Offline as e:
+                    term.status.display_offline(str(e))
+    finally:
+        if args.stats:
+            client.meter.dump(args.stats)
+
+
+if __name__ == '__main__':
+    main()